@@ -0,0 +1,53 @@
+import logging
+from contextlib import contextmanager
+from typing import Any, Callable
+from torch import Tensor
+from wrappers import EmbedderWrapper, SentimentWrapper, ExtractionWrapper
+from facts import FactSystem
+
+logger = logging.getLogger(__name__)
+
+
+class TurnAnalysis:
+    def __init__(self, facts: FactSystem = None):
+        self.facts: FactSystem = facts
+        self._features: dict[tuple, Any] = {}
+        self.stats: dict[str, int] = {"skipped_leaves": 0}
+        # id(similarity leaf) -> (batch, index) for the conditions being evaluated.
+        self.batches: dict[int, tuple[Any, int]] = {}
+
+    def embedding(self, embedder: EmbedderWrapper, text: str) -> Tensor:
+        return self.__feature__("embedding", embedder, text, embedder.encode)
+
+    def sentiment(self, sentiment: SentimentWrapper, text: str) -> dict:
+        return self.__feature__("sentiment", sentiment, text, sentiment.encode)
+
+    def entities(self, extr: ExtractionWrapper, text: str) -> list[str]:
+        return self.__feature__("entities", extr, text, extr.extract_entities)
+
+    @contextmanager
+    def scoring(self, batches: dict[int, tuple[Any, int]]):
+        previous = self.batches
+        self.batches = batches
+        try:
+            yield self
+        finally:
+            self.batches = previous
+
+    def count(self, name: str, value: int = 1):
+        self.stats[name] = self.stats.get(name, 0) + value
+
+    def has(self, key: tuple) -> bool:
+        return key in self._features
+
+    def cached(self, key: tuple, compute: Callable[[], Any]) -> Any:
+        if key not in self._features:
+            self._features[key] = compute()
+        return self._features[key]
+
+    def __feature__(self, kind: str, wrapper: Any, text: str, compute: Callable[[str], Any]) -> Any:
+        key = (kind, id(wrapper), text)
+        if key not in self._features:
+            logger.debug(f"Computing {kind} for: {text}")
+            self._features[key] = compute(text)
+        return self._features[key]
@@ -0,0 +1,99 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class BatchStats:
+    def __init__(self):
+        self.batches = 0
+        self.items = 0
+        self.max_batch_size = 0
+        self.total_queue_latency = 0.0
+        self.max_queue_latency = 0.0
+
+    def record(self, size: int, latencies: list[float]):
+        self.batches += 1
+        self.items += size
+        self.max_batch_size = max(self.max_batch_size, size)
+        self.total_queue_latency += sum(latencies)
+        self.max_queue_latency = max(self.max_queue_latency, *latencies)
+
+    def to_dict(self) -> dict[str, float]:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0,
+            "max_batch_size": self.max_batch_size,
+            "mean_queue_latency": self.total_queue_latency / self.items if self.items else 0,
+            "max_queue_latency": self.max_queue_latency,
+        }
+
+
+class MicroBatcher:
+    def __init__(self, func: Callable[[list[Any]], list[Any]], max_batch_size: int = 32, max_wait: float = 0.005, name: str = "batcher"):
+        self.func = func
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.name = name
+        self.stats = BatchStats()
+        self._queue: list[tuple[Any, Future, float]] = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._worker = threading.Thread(target=self.__run__, name=name, daemon=True)
+        self._worker.start()
+
+    def submit(self, item: Any) -> Future:
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"{self.name} is closed")
+            self._queue.append((item, future, time.monotonic()))
+            self._cond.notify()
+        return future
+
+    def __call__(self, item: Any) -> Any:
+        return self.submit(item).result()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._worker.join()
+
+    def __next_batch__(self) -> list[tuple[Any, Future, float]]:
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            if self._queue:
+                deadline = self._queue[0][2] + self.max_wait
+                while len(self._queue) < self.max_batch_size and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            batch = self._queue[:self.max_batch_size]
+            del self._queue[:self.max_batch_size]
+            return batch
+
+    def __run__(self):
+        while True:
+            batch = self.__next_batch__()
+            if not batch:
+                return
+            started = time.monotonic()
+            self.stats.record(len(batch), [started - enqueued for _, _, enqueued in batch])
+            try:
+                results = list(self.func([item for item, _, _ in batch]))
+                if len(results) != len(batch):
+                    raise ValueError(f"{self.name} returned {len(results)} results for a batch of {len(batch)}")
+                for (_, future, _), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                logger.error(f"Error in {self.name} batch of {len(batch)}: {e}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
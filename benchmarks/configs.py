@@ -0,0 +1,150 @@
+# Generators for synthetic dialogue configs of arbitrary size. Every generator is
+# seeded, so a given size and seed always produces the same config.
+import json
+import os
+import random
+
+TOPICS = ["cat", "ale", "gold", "quest", "sword", "dragon", "tavern", "roof", "well", "guards",
+          "healer", "thief", "map", "forest", "river", "bridge", "king", "letter", "key", "ring",
+          "storm", "harvest", "festival", "debt", "prison", "ship", "temple", "wolf", "potion", "song"]
+VERBS = ["asks about", "mentions", "agrees to", "refuses", "complains about", "wants", "offers", "jokes about"]
+SYLLABLES = ["ka", "ri", "mo", "bel", "dor", "an", "th", "ul", "ven", "sa", "gro", "li", "mar", "ok", "es"]
+SECTIONS = ["characters", "places", "items"]
+RELATIONS = ["friends", "enemies", "located_in", "owns", "knows"]
+
+
+def phrase(rng: random.Random) -> str:
+    return f"user {rng.choice(VERBS)} {rng.choice(TOPICS)}"
+
+
+def condition(rng: random.Random, facts: list[str] = None) -> str:
+    kind = rng.random()
+    if kind < 0.5:
+        return f"sim('{phrase(rng)}')"
+    if kind < 0.7:
+        return f"sim('{phrase(rng)}') or (sent('{rng.choice(['pos', 'neg'])}') > 0.7)"
+    if kind < 0.85 or not facts:
+        return f"sent('{rng.choice(['pos', 'neg'])}') > {rng.choice([0.6, 0.7, 0.8])}"
+    return f"fact('{rng.choice(facts)}') and sim('{phrase(rng)}')"
+
+
+def name(rng: random.Random, used: set[str]) -> str:
+    while True:
+        candidate = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))).capitalize()
+        if candidate not in used:
+            used.add(candidate)
+            return candidate
+
+
+def world_config(entities: int = 50, relations: int = 2, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    used = set()
+    names = [(SECTIONS[i % len(SECTIONS)], name(rng, used)) for i in range(entities)]
+    data = {section: {} for section in SECTIONS}
+    for section, entity in names:
+        record = {"description": f"{rng.choice(['old', 'young', 'rusty', 'famous', 'hidden'])} {section[:-1]} tied to the {rng.choice(TOPICS)}"}
+        for _ in range(relations):
+            relation = rng.choice(RELATIONS)
+            record.setdefault(relation, []).append(rng.choice(names)[1])
+        data[section][entity] = record
+    return data
+
+
+def fsm_config(states: int = 10, transitions: int = 3, seed: int = 0, facts: list[str] = None) -> dict:
+    rng = random.Random(seed)
+    config = {"initial_state": "s0", "states": {}}
+    for i in range(states):
+        config["states"][f"s{i}"] = {
+            "template": f"Talk about the {rng.choice(TOPICS)} and the {rng.choice(TOPICS)}",
+            "urgency": round(rng.random(), 2),
+            "freedom": round(rng.random(), 2),
+            "on_enter": f"enter_s{i}",
+            "transitions": [
+                {
+                    "to": f"s{rng.randrange(states)}",
+                    "template": f"React to the player and mention the {rng.choice(TOPICS)}",
+                    "condition": condition(rng, facts),
+                }
+                for _ in range(transitions)
+            ],
+        }
+    return config
+
+
+def rule_config(rules: int = 20, seed: int = 0, facts: list[str] = None) -> dict:
+    rng = random.Random(seed)
+    return {
+        "description": "Synthetic NPC with many personality rules.",
+        "rules": {
+            f"rule{i}": {
+                "template": f"Show strong feelings about the {rng.choice(TOPICS)}",
+                "freedom": round(rng.random(), 2),
+                "type": rng.choice(["insert", "insert", "overwrite"]),
+                "condition": f"({condition(rng, facts)}) > {rng.choice([0.3, 0.4, 0.5])}",
+            }
+            for i in range(rules)
+        },
+    }
+
+
+def bt_config(depth: int = 3, branching: int = 3, seed: int = 0, facts: list[str] = None) -> dict:
+    rng = random.Random(seed)
+    counter = iter(range(1 << 30))
+
+    def node(level: int) -> dict:
+        if level == depth:
+            return {
+                "type": "sequence",
+                "children": [
+                    {"type": "condition", "condition": condition(rng, facts)},
+                    {"type": "action", "template": f"Bring up the {rng.choice(TOPICS)}",
+                     "callback": f"bt_action{next(counter)}"},
+                ],
+            }
+        return {"type": "selector" if level % 2 == 0 else "sequence",
+                "children": [node(level + 1) for _ in range(branching)]}
+
+    return {"description": "Synthetic NPC driven by a behaviour tree.", "behavior_tree": node(0)}
+
+
+def goap_config(layers: int = 4, width: int = 25, variants: int = 3, seed: int = 0) -> dict:
+    # Facts are arranged in layers; each fact has several actions that set it, each
+    # requiring a random pair of facts from the previous layer and costing 1-5.
+    rng = random.Random(seed)
+    actions = {}
+    for layer in range(layers):
+        for i in range(width):
+            for v in range(variants):
+                action = {
+                    "effects": {f"f{layer}_{i}": True},
+                    "cost": rng.randint(1, 5),
+                    "template": f"Ask the player for help with the {rng.choice(TOPICS)}",
+                    "condition": f"sim('{phrase(rng)}') > 0.2",
+                    "on_success": f"done_f{layer}_{i}",
+                }
+                if layer > 0:
+                    required = rng.sample(range(width), min(2, width))
+                    action["preconditions"] = [" and ".join(f"fact('f{layer - 1}_{r}')" for r in required)]
+                actions[f"set_f{layer}_{i}_{v}"] = action
+    goal = {f"f{layers - 1}_{i}": True for i in rng.sample(range(width), min(2, width))}
+    return {"actions": actions, "goal": goal}
+
+
+def player_inputs(count: int, seed: int = 0, world: dict = None) -> list[str]:
+    rng = random.Random(seed)
+    names = [entity for section in (world or {}).values() for entity in section]
+    inputs = []
+    for _ in range(count):
+        words = [rng.choice(["yes", "no", "well", "maybe", "sure", "never"]), "I",
+                 rng.choice(VERBS).split()[0], "the", rng.choice(TOPICS)]
+        if names and rng.random() < 0.5:
+            words += ["with", rng.choice(names)]
+        inputs.append(" ".join(words))
+    return inputs
+
+
+def write_config(data: dict, directory: str, name: str) -> str:
+    path = os.path.join(directory, f"{name}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=1)
+    return path
@@ -0,0 +1,66 @@
+# Synthetic GOAP domains for timing the planner: python -m benchmarks.goapPlanner
+import argparse
+import logging
+import statistics
+import time
+from facts import FactSystem
+from flow.impl.goapDialogueFlow import Action, GOAPPlanner
+from benchmarks.stubs import StubModels
+from benchmarks import configs
+
+
+def build_domain(layers: int, width: int, variants: int, seed: int) -> tuple[dict[str, Action], dict, FactSystem]:
+    config = configs.goap_config(layers, width, variants, seed)
+    models = StubModels()
+    facts = FactSystem()
+    actions = {}
+    for name, data in config["actions"].items():
+        data["name"] = name
+        actions[name] = Action.from_dict(data, models.embedder, models.sentiment, models.paraphraser, facts)
+    return actions, config["goal"], facts
+
+
+def timed(func) -> tuple[float, any]:
+    start = time.perf_counter()
+    result = func()
+    return (time.perf_counter() - start) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--width", type=int, default=25)
+    parser.add_argument("--variants", type=int, default=3)
+    parser.add_argument("--seeds", type=int, default=5)
+    parser.add_argument("--max-expansions", type=int, default=20000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    cold, warm, replan, lengths, expansions = [], [], [], [], []
+    for seed in range(args.seeds):
+        actions, goal, facts = build_domain(args.layers, args.width, args.variants, seed)
+        planner = GOAPPlanner(actions, args.max_expansions)
+        ms, plan = timed(lambda: planner.plan(facts, goal))
+        cold.append(ms)
+        expansions.append(planner.stats["expansions"])
+        if plan == None:
+            print(f"seed {seed}: no plan found")
+            continue
+        lengths.append(len(plan))
+        warm.append(timed(lambda: planner.plan(facts, goal))[0])
+        # A quest-giver step failing: replan around the first action, then follow the plan.
+        replan.append(timed(lambda: planner.plan(facts, goal, avoid=[plan[0].name]))[0])
+        for action in plan:
+            action.apply_effects(None, facts)
+            warm.append(timed(lambda: planner.plan(facts, goal))[0])
+
+    print(f"actions per domain: {len(actions)}, facts: {args.layers * args.width}")
+    print(f"plan length: mean {statistics.mean(lengths):.1f}" if lengths else "plan length: -")
+    print(f"expansions: mean {statistics.mean(expansions):.0f}, max {max(expansions)}")
+    for label, samples in (("cold plan", cold), ("cached plan", warm), ("replan", replan)):
+        if samples:
+            print(f"{label:>12}: median {statistics.median(samples):.3f} ms, max {max(samples):.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+# Times the full pipeline on stub models and synthetic configs:
+#   python -m benchmarks.run --scales small,medium --out results.jsonl
+# Results are appended as JSON lines tagged with the commit, so runs can be compared.
+import argparse
+import gc
+import json
+import logging
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+from facts import FactSystem
+from events import EventSystem
+from tracing import tracer
+from condition import default_registry
+from pipeline import DialoguePipline
+from session import SessionStore
+from preprocessing.impl.simplePreprocessor import SimplePreprocessor
+from flow.impl.fsmDialogueFlowModule import FSMDialogueFlowModule
+from flow.impl.goapDialogueFlow import GOAPDialogueFlowModule
+from personality.impl.simplePersonalityModule import SimplePersonalityModule
+from personality.impl.behaviourTreePresonalityModule import BehaviorTreePersonalityModule
+from memory.impl.knowledgeGrpaphMemoryModule import KnowledgeGrpaphMemoryModule
+from generation.impl.simpleProcessingModule import SimpleProcessingModule
+from models import rss_mb
+from benchmarks.stubs import StubModels
+from benchmarks import configs
+
+SCALES = {
+    "small": {"states": 10, "transitions": 3, "rules": 10, "bt_depth": 2, "goap_layers": 2, "goap_width": 5, "entities": 20},
+    "medium": {"states": 100, "transitions": 5, "rules": 100, "bt_depth": 3, "goap_layers": 3, "goap_width": 15, "entities": 500},
+    "large": {"states": 1000, "transitions": 8, "rules": 1000, "bt_depth": 5, "goap_layers": 4, "goap_width": 25, "entities": 5000},
+}
+FACTS = ["quest_started", "has_gold", "met_guard", "angry"]
+
+
+def percentile(samples: list[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0
+
+
+def commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def measured(memory: dict[str, float], name: str, factory):
+    # RSS rather than tracemalloc, so tensors allocated by torch are counted too.
+    gc.collect()
+    before = rss_mb()
+    module = factory()
+    memory[name] = rss_mb() - before
+    return module
+
+
+def build(directory: str, scale: dict, flow: str, personality: str, models: StubModels, seed: int, memory: dict[str, float]) -> DialoguePipline:
+    # Interned nodes from the previous build would keep its models and facts alive.
+    default_registry.clear()
+    facts = FactSystem()
+    events = EventSystem()
+    for i, key in enumerate(FACTS):
+        facts.set_fact(key, i % 2 == 0)
+    world = configs.write_config(configs.world_config(scale["entities"], seed=seed), directory, "world")
+    if flow == "fsm":
+        path = configs.write_config(configs.fsm_config(scale["states"], scale["transitions"], seed, FACTS), directory, "fsm")
+        flow_module = measured(memory, "dialogue", lambda: FSMDialogueFlowModule(
+            path, models.embedder, models.sentiment, models.paraphraser, facts, events))
+    else:
+        path = configs.write_config(configs.goap_config(scale["goap_layers"], scale["goap_width"], seed=seed), directory, "goap")
+        flow_module = measured(memory, "dialogue", lambda: GOAPDialogueFlowModule(
+            path, models.embedder, models.sentiment, models.paraphraser, facts, events))
+    if personality == "rules":
+        path = configs.write_config(configs.rule_config(scale["rules"], seed, FACTS), directory, "rules")
+        personality_module = measured(memory, "personality", lambda: SimplePersonalityModule(
+            path, models.embedder, models.sentiment, models.paraphraser, facts, events))
+    else:
+        path = configs.write_config(configs.bt_config(scale["bt_depth"], seed=seed, facts=FACTS), directory, "bt")
+        personality_module = measured(memory, "personality", lambda: BehaviorTreePersonalityModule(
+            path, models.embedder, models.sentiment, models.paraphraser, facts, events))
+    memory_module = measured(memory, "memory", lambda: KnowledgeGrpaphMemoryModule(world, models.extractor, facts))
+    return DialoguePipline(
+        SimplePreprocessor(models.summarizer), flow_module, personality_module,
+        memory_module, SimpleProcessingModule(models.llm),
+        sessions=SessionStore(facts_factory=facts.fork), events=events)
+
+
+def run(scale_name: str, flow: str, personality: str, turns: int, warmup: int, llm_latency: float, seed: int) -> dict:
+    scale = SCALES[scale_name]
+    models = StubModels(llm_latency=llm_latency)
+    gc.collect()
+    rss_before = rss_mb()
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        memory = {}
+        pipeline = build(directory, scale, flow, personality, models, seed, memory)
+        build_seconds = time.perf_counter() - start
+    rss_built = rss_mb()
+    inputs = configs.player_inputs(warmup + turns, seed, configs.world_config(scale["entities"], seed=seed))
+    for text in inputs[:warmup]:
+        pipeline.evaluate(text)
+
+    calls_before = models.calls()
+    tracer.clear()
+    tracer.enable()
+    latencies = []
+    start = time.perf_counter()
+    for text in inputs[warmup:]:
+        turn_start = time.perf_counter()
+        pipeline.evaluate(text)
+        latencies.append((time.perf_counter() - turn_start) * 1000)
+    elapsed = time.perf_counter() - start
+    tracer.disable()
+
+    stages = {}
+    for event in tracer.to_chrome()["traceEvents"]:
+        if event["cat"] == "stage" and event["name"] != "turn":
+            stages.setdefault(event["name"], []).append(event["dur"] / 1000)
+    calls = {name: count - calls_before[name] for name, count in models.calls().items()}
+    return {
+        "commit": commit(),
+        "python": platform.python_version(),
+        "scale": scale_name,
+        "flow": flow,
+        "personality": personality,
+        "turns": turns,
+        "seed": seed,
+        "llm_latency": llm_latency,
+        "build_seconds": build_seconds,
+        "turns_per_sec": turns / elapsed if elapsed else 0,
+        "p50_ms": percentile(latencies, 0.5),
+        "p99_ms": percentile(latencies, 0.99),
+        "stages": {name: {"p50_ms": percentile(samples, 0.5), "p99_ms": percentile(samples, 0.99),
+                          "rss_mb": memory.get(name, 0)}
+                   for name, samples in stages.items()},
+        "model_calls_per_turn": {name: count / turns for name, count in calls.items()},
+        "rss_build_mb": rss_built - rss_before,
+        "rss_mb": rss_mb(),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scales", default="small,medium")
+    parser.add_argument("--flows", default="fsm,goap")
+    parser.add_argument("--personalities", default="rules,bt")
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--llm-latency", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    for scale in args.scales.split(","):
+        for flow in args.flows.split(","):
+            for personality in args.personalities.split(","):
+                result = run(scale, flow, personality, args.turns, args.warmup, args.llm_latency, args.seed)
+                stages = " ".join(f"{name}={s['p50_ms']:.2f}" for name, s in result["stages"].items())
+                print(f"{scale:>7} {flow:>4} {personality:>5}: {result['turns_per_sec']:8.1f} turns/s "
+                      f"p50 {result['p50_ms']:7.2f} ms p99 {result['p99_ms']:7.2f} ms "
+                      f"rss +{result['rss_build_mb']:.0f} MB | {stages}")
+                if args.out:
+                    with open(args.out, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# Load test for the multi-process serving pool, on stub models:
+#   python -m benchmarks.serving --workers 1,2,4 --sessions 64 --turns 20
+# Every session sends its turns one after another, as a player would, so the
+# pool only gets parallel work from different sessions.
+import argparse
+import functools
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from serving import ServingPool
+from pipeline import DialoguePipline
+from benchmarks.stubs import StubModels
+from benchmarks import configs
+from benchmarks.run import SCALES, build, commit, percentile
+
+
+def stub_pipeline(scale: str, flow: str, personality: str, llm_latency: float, seed: int) -> DialoguePipline:
+    with tempfile.TemporaryDirectory() as directory:
+        return build(directory, SCALES[scale], flow, personality, StubModels(llm_latency=llm_latency), seed, {})
+
+
+def drive(pool: ServingPool, inputs: list[str], sessions: int, turns: int, rebalance: bool) -> tuple[list[float], float]:
+    latencies = []
+    pause = 0.0
+    lock = threading.Lock()
+    halfway = threading.Barrier(sessions + 1) if rebalance else None
+
+    def player(index: int):
+        session_id = f"player-{index}"
+        for turn in range(turns):
+            if halfway != None and turn == turns // 2:
+                halfway.wait()
+                halfway.wait()
+            start = time.perf_counter()
+            pool.evaluate(inputs[(index * turns + turn) % len(inputs)], session_id)
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=player, args=(i,)) for i in range(sessions)]
+    for thread in threads:
+        thread.start()
+    if halfway != None:
+        # Grow the pool by one worker while every session is idle, then resume.
+        # Spawning and building the worker is timed apart from the turns around it.
+        halfway.wait()
+        start = time.perf_counter()
+        pool.add_worker()
+        pause = time.perf_counter() - start
+        halfway.wait()
+    for thread in threads:
+        thread.join()
+    return latencies, pause
+
+
+def run(workers: int, sessions: int, turns: int, scale: str, flow: str, personality: str,
+        llm_latency: float, seed: int, start_method: str, rebalance: bool) -> dict:
+    factory = functools.partial(stub_pipeline, scale, flow, personality, llm_latency, seed)
+    inputs = configs.player_inputs(sessions * turns, seed, configs.world_config(SCALES[scale]["entities"], seed=seed))
+    with ServingPool(factory, workers, start_method=start_method, log_level=logging.ERROR) as pool:
+        pool.evaluate(inputs[0], "warmup")
+        start = time.perf_counter()
+        latencies, pause = drive(pool, inputs, sessions, turns, rebalance)
+        elapsed = time.perf_counter() - start - pause
+        stats = pool.stats()
+    return {
+        "commit": commit(),
+        "workers": workers,
+        "cpus": os.cpu_count(),
+        "sessions": sessions,
+        "turns": turns,
+        "scale": scale,
+        "flow": flow,
+        "personality": personality,
+        "llm_latency": llm_latency,
+        "rebalance": rebalance,
+        "turns_per_sec": len(latencies) / elapsed if elapsed else 0,
+        "p50_ms": percentile(latencies, 0.5),
+        "p99_ms": percentile(latencies, 0.99),
+        "rebalance_ms": pause * 1000,
+        "turns_per_worker": {name: data.get("turns", 0) for name, data in stats.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default=",".join(str(n) for n in sorted({1, 2, os.cpu_count() or 1})))
+    parser.add_argument("--sessions", type=int, default=64)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--scale", default="small")
+    parser.add_argument("--flow", default="fsm")
+    parser.add_argument("--personality", default="rules")
+    parser.add_argument("--llm-latency", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--start-method", default="spawn")
+    parser.add_argument("--rebalance", action="store_true")
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    baseline = None
+    for workers in [int(n) for n in args.workers.split(",")]:
+        result = run(workers, args.sessions, args.turns, args.scale, args.flow, args.personality,
+                     args.llm_latency, args.seed, args.start_method, args.rebalance)
+        baseline = baseline or result["turns_per_sec"]
+        result["speedup"] = result["turns_per_sec"] / baseline if baseline else 0
+        pause = f" rebalance {result['rebalance_ms']:.0f} ms" if args.rebalance else ""
+        print(f"{workers:>3} workers: {result['turns_per_sec']:8.1f} turns/s x{result['speedup']:.2f} "
+              f"p50 {result['p50_ms']:7.2f} ms p99 {result['p99_ms']:7.2f} ms{pause} | "
+              f"{' '.join(str(n) for n in result['turns_per_worker'].values())}")
+        if args.out:
+            with open(args.out, "a", encoding="utf-8") as f:
+                f.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# Deterministic stand-ins for the model wrappers, so the pipeline can be timed
+# without downloading models or running an LLM server.
+import hashlib
+import re
+import time
+from typing import Iterator
+import torch
+import torch.nn.functional as F
+from wrappers import (SummarizationWrapper, EmbedderWrapper, SentimentWrapper, ExtractionWrapper,
+                      ParaphraserWrapper, LLMWrapper)
+
+WORD = re.compile(r"\w+")
+POSITIVE = {"yes", "sure", "thanks", "great", "help", "love", "good", "happy", "agree", "sorry"}
+NEGATIVE = {"no", "never", "hate", "bad", "stupid", "refuse", "won't", "not", "ugly", "angry"}
+
+
+def stable_seed(text: str) -> int:
+    return int(hashlib.sha1(text.encode("utf-8")).hexdigest()[:8], 16)
+
+
+class HashEmbedder:
+    # Bag of words over seeded random word vectors: texts sharing words are similar,
+    # and the same text embeds the same way in every process and on every commit.
+    def __init__(self, dim: int = 64):
+        self.dim = dim
+        self.words: dict[str, torch.Tensor] = {}
+        self.calls = 0
+
+    def word(self, word: str) -> torch.Tensor:
+        vector = self.words.get(word)
+        if vector is None:
+            generator = torch.Generator().manual_seed(stable_seed(word))
+            vector = self.words[word] = torch.randn(self.dim, generator=generator)
+        return vector
+
+    def __call__(self, text: str) -> torch.Tensor:
+        self.calls += 1
+        words = WORD.findall(text.lower()) or [""]
+        return F.normalize(torch.stack([self.word(w) for w in words]).sum(dim=0), dim=0)
+
+
+class LexiconSentiment:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, text: str) -> dict:
+        self.calls += 1
+        words = WORD.findall(text.lower())
+        score = sum(w in POSITIVE for w in words) - sum(w in NEGATIVE for w in words)
+        if score == 0:
+            return {"label": "NEU", "score": 0.9}
+        return {"label": "POS" if score > 0 else "NEG", "score": min(0.99, 0.6 + 0.1 * abs(score))}
+
+
+class KeywordExtractor:
+    # Capitalised words stand in for named entities.
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, text: str) -> list[str]:
+        self.calls += 1
+        return re.findall(r"\b[A-Z][a-z]+(?: [A-Z][a-z]+)*", text)
+
+
+class TemplateParaphraser:
+    PREFIXES = ["", "Well, ", "So, ", "Honestly, ", "I think ", "Look, "]
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, num: int, text: str) -> list[str]:
+        self.calls += 1
+        return [f"{self.PREFIXES[i % len(self.PREFIXES)]}{text}" for i in range(1, num + 1)]
+
+
+class FakeLLM:
+    # Responds after a fixed latency; streaming spreads it over a few chunks.
+    def __init__(self, latency: float = 0.0, chunks: int = 4):
+        self.latency = latency
+        self.chunks = chunks
+        self.calls = 0
+
+    def response(self, prompt: str) -> str:
+        return f"Response {stable_seed(prompt) % 10000} to a {len(prompt)} character prompt."
+
+    def __call__(self, prompt: str) -> str:
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self.response(prompt)
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        self.calls += 1
+        words = self.response(prompt).split(" ")
+        size = max(1, len(words) // self.chunks)
+        for i in range(0, len(words), size):
+            if self.latency:
+                time.sleep(self.latency / self.chunks)
+            yield " ".join(words[i:i + size]) + " "
+
+
+class StubModels:
+    def __init__(self, dim: int = 64, llm_latency: float = 0.0):
+        self.embedder_model = HashEmbedder(dim)
+        self.sentiment_model = LexiconSentiment()
+        self.extractor_model = KeywordExtractor()
+        self.paraphraser_model = TemplateParaphraser()
+        self.llm_model = FakeLLM(llm_latency)
+        self.summarizer = SummarizationWrapper(lambda text, min_len, max_len: " ".join(text.split()[:max_len]))
+        self.embedder = EmbedderWrapper(self.embedder_model)
+        self.sentiment = SentimentWrapper(self.sentiment_model)
+        self.extractor = ExtractionWrapper(self.extractor_model)
+        self.paraphraser = ParaphraserWrapper(self.paraphraser_model)
+        self.llm = LLMWrapper(self.llm_model, self.llm_model.stream)
+
+    def calls(self) -> dict[str, int]:
+        return {
+            "embed": self.embedder_model.calls,
+            "sentiment": self.sentiment_model.calls,
+            "ner": self.extractor_model.calls,
+            "paraphrase": self.paraphraser_model.calls,
+            "llm": self.llm_model.calls,
+        }
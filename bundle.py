@@ -0,0 +1,226 @@
+import hashlib
+import json
+import logging
+import os
+import struct
+import numpy as np
+import torch
+import loader
+from condition import Condition, ConditionRegistry, default_registry
+from wrappers import EmbedderWrapper, ParaphraserWrapper
+
+logger = logging.getLogger(__name__)
+
+# File layout: magic, header length, JSON header, padding
+# to ALIGNMENT, then the row-major matrix of normalized embeddings. Every worker
+# process maps the same file, so the matrix lives once in the page cache.
+MAGIC = b"NPCBNDL\0"
+BUNDLE_VERSION = 2
+ALIGNMENT = 64
+PREAMBLE = struct.Struct("<8sQ")
+
+
+class BundleError(ValueError):
+    pass
+
+
+def file_digest(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def bundle_checksum(sources: list[str], model_id: str, paraphrasings: int) -> str:
+    digest = hashlib.sha256(f"{BUNDLE_VERSION}\0{model_id}\0{paraphrasings}".encode("utf-8"))
+    for path in sorted(os.path.normpath(p) for p in sources):
+        digest.update(f"\0{path}\0{file_digest(path)}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def condition_expressions(data) -> list[str]:
+    # Finds conditions anywhere in a config: FSM transitions, rules, BT condition
+    # nodes and GOAP actions all use "condition", GOAP actions also "preconditions".
+    found = []
+    stack = [data]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            for key, value in item.items():
+                if key == "condition" and isinstance(value, str):
+                    found.append(value)
+                elif key == "preconditions" and isinstance(value, list):
+                    found += [p for p in value if isinstance(p, str)]
+                else:
+                    stack.append(value)
+        elif isinstance(item, list):
+            stack.extend(item)
+    return found
+
+
+class NodeTable:
+    # Flattens interned condition trees into rows whose children are row indices,
+    # children always before parents.
+    def __init__(self):
+        self.nodes: list[tuple] = []
+        self.rows: list[np.ndarray] = []
+        self.row_count = 0
+        self._index: dict[int, int] = {}
+
+    def add(self, node: Condition.Evaluator) -> int:
+        index = self._index.get(id(node))
+        if index != None:
+            return index
+        if isinstance(node, Condition.OperatorEvaluator):
+            row = ("op", node.operator, self.add(node.ev1), self.add(node.ev2))
+        elif isinstance(node, Condition.OrEvaluator):
+            row = ("or", self.add(node.ev1), self.add(node.ev2))
+        elif isinstance(node, Condition.AndEvaluator):
+            row = ("and", self.add(node.ev1), self.add(node.ev2))
+        elif isinstance(node, Condition.SimilarityEvaluator):
+            row = ("sim", node.args[0], list(node.args), self.row_count)
+            self.rows.append(node.arg_embeddings.detach().float().cpu().numpy())
+            self.row_count += len(node.args)
+        elif isinstance(node, Condition.SentimentEvaluator):
+            row = ("sent", node.label)
+        elif isinstance(node, Condition.FactEvaluator):
+            row = ("fact", node.arg)
+        elif isinstance(node, Condition.NumericEvaluator):
+            row = ("num", node.value)
+        else:
+            raise BundleError(f"Cannot serialize condition node {type(node).__name__}")
+        self.nodes.append(row)
+        self._index[id(node)] = len(self.nodes) - 1
+        return len(self.nodes) - 1
+
+
+def compile_bundle(sources: list[str], output: str, embedder: EmbedderWrapper, paraphraser: ParaphraserWrapper,
+                   model_id: str, paraphrasings: int = 0, dtype: str = "float32") -> str:
+    configs = {os.path.normpath(path): loader.load_config(path) for path in sources}
+    registry = ConditionRegistry()
+    table = NodeTable()
+    roots: dict[str, int] = {}
+    for path, data in configs.items():
+        for expr in condition_expressions(data):
+            if expr in roots:
+                continue
+            try:
+                condition = Condition(expr, embedder, None, paraphraser, None, paraphrasings, registry)
+            except SyntaxError as e:
+                logger.warning(f"Not bundling condition '{expr}' from {path}: {e}")
+                continue
+            roots[expr] = table.add(condition.expr)
+
+    matrix = np.concatenate(table.rows).astype(dtype) if table.rows else np.zeros((0, 0), dtype=dtype)
+    header = {
+        "version": BUNDLE_VERSION,
+        "checksum": bundle_checksum(sources, model_id, paraphrasings),
+        "model_id": model_id,
+        "paraphrasings": paraphrasings,
+        "configs": configs,
+        "nodes": table.nodes,
+        "roots": roots,
+        "dtype": dtype,
+        "shape": matrix.shape,
+    }
+    payload = json.dumps(header).encode("utf-8")
+    offset = PREAMBLE.size + len(payload)
+    padding = -offset % ALIGNMENT
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    # Readers keep whichever file they mapped; a new one only replaces the path
+    # once it is complete.
+    temp = f"{output}.{os.getpid()}.tmp"
+    with open(temp, "wb") as f:
+        f.write(PREAMBLE.pack(MAGIC, len(payload)))
+        f.write(payload)
+        f.write(b"\0" * padding)
+        f.write(matrix.tobytes())
+    os.replace(temp, output)
+    logger.info(f"Compiled bundle {output}: {len(configs)} configs, {len(roots)} conditions, "
+                f"{len(table.nodes)} nodes, {matrix.shape[0]} embeddings")
+    return output
+
+
+class NPCBundle:
+    def __init__(self, path: str, header: dict, matrix: np.ndarray, identity: tuple = None):
+        self.path = path
+        self.identity = identity
+        self.rejected: tuple = None
+        self.header = header
+        self.configs: dict[str, dict] = header["configs"]
+        self.nodes: list[tuple] = [tuple(node) for node in header["nodes"]]
+        self.roots: dict[str, int] = header["roots"]
+        self.paraphrasings: int = header["paraphrasings"]
+        self.model_id: str = header["model_id"]
+        self.matrix = matrix
+
+    @staticmethod
+    def load(path: str, sources: list[str] = None, model_id: str = None) -> 'NPCBundle':
+        # With sources and model_id given, a bundle built from other configs or
+        # another embedding model is rejected rather than silently used.
+        if not os.path.isfile(path):
+            raise BundleError(f"Bundle '{path}' does not exist")
+        # The matrix is mapped through the same open file as the header, so a bundle
+        # swapped in concurrently can't mix one file's header with another's rows.
+        with open(path, "rb") as f:
+            magic, length = PREAMBLE.unpack(f.read(PREAMBLE.size))
+            if magic != MAGIC:
+                raise BundleError(f"'{path}' is not an NPC bundle")
+            try:
+                header = json.loads(f.read(length).decode("utf-8"))
+            except ValueError as e:
+                raise BundleError(f"Bundle '{path}' has an unreadable header: {e}")
+            if header.get("version") != BUNDLE_VERSION:
+                raise BundleError(f"Bundle version {header['version']} is not {BUNDLE_VERSION}")
+            if model_id != None and header["model_id"] != model_id:
+                raise BundleError(f"Bundle was compiled for '{header['model_id']}', not '{model_id}'")
+            if sources != None and header["checksum"] != bundle_checksum(sources, header["model_id"], header["paraphrasings"]):
+                raise BundleError("Bundle is out of date with its source configs")
+            offset = PREAMBLE.size + length
+            offset += -offset % ALIGNMENT
+            shape = tuple(header["shape"])
+            # Copy-on-write rather than read-only, because torch only wraps writable
+            # arrays without copying; nothing writes to it, so the pages stay shared.
+            matrix = np.memmap(f, dtype=header["dtype"], mode="c", offset=offset, shape=shape) if shape[0] \
+                else np.zeros(shape, dtype=header["dtype"])
+            identity = NPCBundle.__identity__(os.fstat(f.fileno()))
+        logger.info(f"Loaded bundle {path}: {len(header['roots'])} conditions, {shape[0]} embeddings")
+        return NPCBundle(path, header, matrix, identity)
+
+    @staticmethod
+    def __identity__(stat: os.stat_result) -> tuple:
+        return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def changed(self) -> bool:
+        # True once another bundle has been swapped in at this path, unless that one
+        # was rejected.
+        identity = self.__current__()
+        return identity != None and identity != self.identity and identity != self.rejected
+
+    def reject(self):
+        self.rejected = self.__current__()
+
+    def __current__(self) -> tuple:
+        try:
+            return NPCBundle.__identity__(os.stat(self.path))
+        except FileNotFoundError:
+            return None
+
+    def condition(self, expr: str, paraphrasings: int = 0) -> int:
+        if paraphrasings != self.paraphrasings:
+            return None
+        return self.roots.get(expr)
+
+    def rows(self, row: int, count: int, device: str = "cpu") -> torch.Tensor:
+        # A view into the shared mapping for float32 bundles on the CPU; other
+        # dtypes and devices get a private copy.
+        view = torch.from_numpy(self.matrix[row:row + count])
+        if view.dtype != torch.float32 or torch.device(device).type != "cpu":
+            return view.to(device, torch.float32)
+        return view
+
+    def install(self, registry: ConditionRegistry = default_registry):
+        # Nodes interned from a previously installed bundle keep its mapping alive;
+        # clearing them lets it be unmapped once the modules using it are gone.
+        if registry.bundle != None and registry.bundle != self:
+            registry.clear()
+        loader.use_configs(self.configs)
+        registry.bundle = self
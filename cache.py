@@ -0,0 +1,89 @@
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(*parts) -> str:
+    return hashlib.sha1("\x00".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+class JsonCache:
+    def __init__(self, path: str):
+        self.path = path
+        self._entries: dict[str, any] = {}
+        if os.path.isfile(path):
+            self.__load__()
+        logger.info(f"Loaded {len(self._entries)} cached entries from '{path}'")
+
+    def __load__(self):
+        # A crash mid-append leaves a torn last line. It is cut off so the next record
+        # starts on a line of its own; other unreadable records are skipped.
+        complete = 0
+        skipped = 0
+        with open(self.path, "rb") as file:
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break
+                complete += len(line)
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    self._entries[record["key"]] = record["value"]
+                except (ValueError, KeyError, TypeError):
+                    skipped += 1
+        torn = os.path.getsize(self.path) - complete
+        if torn:
+            os.truncate(self.path, complete)
+        if skipped or torn:
+            logger.warning(f"Skipped {skipped} unreadable records and {torn} torn bytes in '{self.path}'")
+
+    def get(self, key: str) -> any:
+        return self._entries.get(key)
+
+    def put(self, key: str, value: any):
+        self._entries[key] = value
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(json.dumps({"key": key, "value": value}) + "\n")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class EmbeddingCache:
+    def __init__(self, path: str):
+        self.data_path = path + ".f32"
+        self.index = JsonCache(path + ".idx")
+        self._map: np.ndarray = None
+
+    def get(self, key: str) -> np.ndarray:
+        record = self.index.get(key)
+        if record == None:
+            return None
+        offset, dim = record
+        if self._map is None or offset + dim > len(self._map):
+            self.__remap__()
+        return self._map[offset:offset + dim]
+
+    def put(self, key: str, vector: np.ndarray):
+        vector = np.ascontiguousarray(vector, dtype=np.float32).reshape(-1)
+        os.makedirs(os.path.dirname(self.data_path) or ".", exist_ok=True)
+        with open(self.data_path, "ab") as file:
+            file.seek(0, os.SEEK_END)
+            offset = file.tell() // vector.itemsize
+            file.write(vector.tobytes())
+        self.index.put(key, [offset, len(vector)])
+
+    def __remap__(self):
+        if os.path.getsize(self.data_path) == 0:
+            self._map = np.zeros(0, dtype=np.float32)
+        else:
+            self._map = np.memmap(self.data_path, dtype=np.float32, mode="r")
+
+    def __len__(self) -> int:
+        return len(self.index)
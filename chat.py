@@ -53,17 +53,25 @@ class ChatApp:
         self.__add_bubble__("You", message, align="right", bg="#0084ff", fg="white")
         self.user_input.delete(0, tk.END)
 
-        threading.Thread(target=self.__evaluate_message__, args=(message,), daemon=True).start()
+        bubble = self.__add_bubble__("Bot", "...", "left", "#e4e6eb", "black")
+        threading.Thread(target=self.__evaluate_message__, args=(message, bubble), daemon=True).start()
 
-    def __evaluate_message__(self, message: str):
+    def __evaluate_message__(self, message: str, bubble: Label):
+        response = ""
         try:
-            response = self.dialogue_pipeline.evaluate(message)
+            for chunk in self.dialogue_pipeline.evaluate_stream(message):
+                response += chunk
+                self.root.after(0, self.__update_bubble__, bubble, response)
         except Exception as e:
             response = f"[Error] {e}"
+            self.root.after(0, self.__update_bubble__, bubble, response)
 
-        self.root.after(0, self.__add_bubble__, "Bot", response, "left", "#e4e6eb", "black")
+    def __update_bubble__(self, bubble: Label, message: str):
+        bubble.configure(text=message)
+        self.canvas.update_idletasks()
+        self.canvas.yview_moveto(1.0)
 
-    def __add_bubble__(self, sender: str, message: str, align: str, bg: str, fg: str):
+    def __add_bubble__(self, sender: str, message: str, align: str, bg: str, fg: str) -> Label:
         bubble_frame = Frame(self.scrollable_frame, bg="#f0f2f5")
         bubble = Label(bubble_frame,
                        text=message,
@@ -83,4 +91,5 @@ class ChatApp:
             bubble_frame.pack(anchor="w", fill="x", padx=10)
 
         self.canvas.update_idletasks()
-        self.canvas.yview_moveto(1.0)
\ No newline at end of file
+        self.canvas.yview_moveto(1.0)
+        return bubble
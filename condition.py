@@ -4,44 +4,126 @@ from abc import ABC, abstractmethod
 from sentence_transformers import SentenceTransformer, util
 from transformers import pipeline
 import re
+import weakref
+from typing import Callable
+import torch
+import torch.nn.functional as F
 from facts import FactSystem
+from analysis import TurnAnalysis
+from tracing import tracer
 from wrappers import EmbedderWrapper, SentimentWrapper, ParaphraserWrapper
 
 logger = logging.getLogger(__name__)
 
+COST_NUMERIC = 0
+COST_FACT = 1
+COST_SENTIMENT = 10
+COST_SIMILARITY = 100
+
+
+TOKEN_PATTERN = re.compile('|'.join('(?P<%s>%s)' % pair for pair in [
+    ('NUMBER',  r"\d+(\.\d*)?"),
+    ('SIM',     r"sim\('.*?'\)"),
+    ('SENT',    r"sent\('.*?'\)"),
+    ('FACT',    r"fact\('.*?'\)"),
+    ('AND',     r"\band\b"),
+    ('OR',      r"\bor\b"),
+    ('OP',      r"<=|>=|==|<|>"),
+    ('LPAREN',  r"\("),
+    ('RPAREN',  r"\)"),
+    ('SKIP',    r"[ \t]+"),
+]))
+
+
+class UncachedFacts:
+    # Passes fact reads through to a FactSystem while bypassing reactive caches.
+    def __init__(self, facts: FactSystem):
+        self.facts = facts
+
+    def get_fact(self, key: str):
+        return self.facts.get_fact(key)
+
+
+class ConditionRegistry:
+    def __init__(self):
+        self._nodes: dict[tuple, 'Condition.Evaluator'] = {}
+        self.hits = 0
+        self.misses = 0
+        self.bundle = None
+
+    def intern(self, context: tuple, key: str, factory: Callable[[], 'Condition.Evaluator']) -> 'Condition.Evaluator':
+        node = self._nodes.get((context, key))
+        if node != None:
+            self.hits += 1
+            return node
+        self.misses += 1
+        node = factory()
+        node.key = key
+        self._nodes[(context, key)] = node
+        return node
+
+    def clear(self):
+        self._nodes.clear()
+
+    def dependency_graph(self) -> dict[str, list[str]]:
+        return {node.key: sorted(node.fact_keys) for node in self._nodes.values() if node.fact_keys}
+
+    def stale(self, facts: FactSystem = None) -> list[str]:
+        # Debugging aid: re-evaluates every cached fact-only node and lists those whose
+        # cached value no longer matches.
+        stale = []
+        for node in self._nodes.values():
+            if node.reactive:
+                system = facts if facts != None else node.default_facts
+                cached = node.reactive_cache.get(system)
+                if cached != None and cached != node.eval("", TurnAnalysis(UncachedFacts(system))):
+                    stale.append(node.key)
+        return stale
+
+    def usage(self) -> dict[str, int]:
+        # Leaf counts by kind ("sim", "sent", "fact"), e.g. to skip loading unused models.
+        usage = {}
+        for node in self._nodes.values():
+            if node.kind != None:
+                usage[node.kind] = usage.get(node.kind, 0) + 1
+        return usage
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+
+default_registry = ConditionRegistry()
+
 
 class Condition():
-    def __init__(self, expr: str, embedder: EmbedderWrapper, sentiment: SentimentWrapper, paraphraser: ParaphraserWrapper, facts: FactSystem, paraphrasings: int = 0):
+    def __init__(self, expr: str, embedder: EmbedderWrapper, sentiment: SentimentWrapper, paraphraser: ParaphraserWrapper, facts: FactSystem, paraphrasings: int = 0, registry: ConditionRegistry = None):
         logger.info(f"Parsing condition: {expr}")
         self.embedder = embedder
         self.sentiment = sentiment
         self.paraphraser = paraphraser
         self.paraphrasings = paraphrasings
         self.facts = facts
+        self.registry = registry if registry != None else default_registry
+        self.context = (embedder, sentiment, paraphraser, facts, paraphrasings)
+        self.skipped_leaves = 0
+        # Conditions compiled into a bundle are rebuilt from its node table, without
+        # tokenizing, parsing, paraphrasing or embedding.
+        bundle = self.registry.bundle
+        root = bundle.condition(expr, paraphrasings) if bundle != None else None
+        if root != None:
+            self.tokens = None
+            self.expr = self.__compile__(self.__load__(bundle, root))
+            return
         self.tokens = self.__tokenize__(expr)
         logger.info(f"tokens: {self.tokens}")
         self.position = 0
-        self.expr = self.__parse__()
+        self.expr = self.__compile__(self.__parse__())
 
     def __tokenize__(self, expr: str):
-        tokens_map = [
-            ('NUMBER',  r"\d+(\.\d*)?"),
-            ('SIM',     r"sim\('.*?'\)"),
-            ('SENT',    r"sent\('.*?'\)"),
-            ('FACT',    r"fact\('.*?'\)"),
-            ('AND',     r"\band\b"),
-            ('OR',      r"\bor\b"),
-            ('OP',      r"<=|>=|==|<|>"),
-            ('LPAREN',  r"\("),
-            ('RPAREN',  r"\)"),
-            ('SKIP',    r"[ \t]+"),
-        ]
-        regex = '|'.join('(?P<%s>%s)' % pair for pair in tokens_map)
-        pattern = re.compile(regex)
         pos = 0
         tokens = []
         while pos < len(expr):
-            match = pattern.match(expr, pos)
+            match = TOKEN_PATTERN.match(expr, pos)
             if not match:
                 raise SyntaxError(
                     f"Unexpected character at {pos}: {expr[pos]}")
@@ -62,28 +144,72 @@ class Condition():
     def __parse__(self):
         return self._parse_or()
 
+    def __intern__(self, key: str, factory: Callable[[], 'Condition.Evaluator']) -> 'Condition.Evaluator':
+        return self.registry.intern(self.context, key, factory)
+
+    def __commutative_key__(self, op: str, left: 'Condition.Evaluator', right: 'Condition.Evaluator') -> str:
+        first, second = sorted([left.key, right.key])
+        return f"({first} {op} {second})"
+
+    def __node__(self, kind: str, *args) -> 'Condition.Evaluator':
+        match kind:
+            case "or":
+                left, right = args
+                return self.__intern__(self.__commutative_key__("or", left, right),
+                                       lambda: self.OrEvaluator(left, right))
+            case "and":
+                left, right = args
+                return self.__intern__(self.__commutative_key__("and", left, right),
+                                       lambda: self.AndEvaluator(left, right))
+            case "op":
+                op, left, right = args
+                return self.__intern__(f"({left.key} {op} {right.key})",
+                                       lambda: self.OperatorEvaluator(left, right, op))
+            case "sim":
+                arg, texts, store, row = args
+                return self.__intern__(f"sim('{arg}')", lambda: self.SimilarityEvaluator(
+                    texts if texts != None else self.__similarity_args__(arg), self.embedder, store, row))
+            case "sent":
+                return self.__intern__(f"sent('{args[0]}')", lambda: self.SentimentEvaluator(args[0], self.sentiment))
+            case "fact":
+                return self.__intern__(f"fact('{args[0]}')", lambda: self.FactEvaluator(args[0], self.facts))
+            case "num":
+                return self.__intern__(repr(args[0]), lambda: self.NumericEvaluator(args[0]))
+            case _:
+                raise ValueError(f"Unknown condition node: {kind}")
+
+    def __load__(self, bundle, index: int) -> 'Condition.Evaluator':
+        kind, *fields = bundle.nodes[index]
+        match kind:
+            case "or" | "and":
+                return self.__node__(kind, self.__load__(bundle, fields[0]), self.__load__(bundle, fields[1]))
+            case "op":
+                return self.__node__(kind, fields[0], self.__load__(bundle, fields[1]), self.__load__(bundle, fields[2]))
+            case "sim":
+                arg, texts, row = fields
+                return self.__node__(kind, arg, texts, bundle, row)
+            case _:
+                return self.__node__(kind, *fields)
+
     def _parse_or(self):
         node = self._parse_and()
         while self.__peek__()[1] == 'or':
             self.__advance__()
-            right = self._parse_and()
-            node = self.OrEvaluator(node, right)
+            node = self.__node__("or", node, self._parse_and())
         return node
 
     def _parse_and(self):
         node = self._parse_comparison()
         while self.__peek__()[1] == 'and':
             self.__advance__()
-            right = self._parse_comparison()
-            node = self.AndEvaluator(node, right)
+            node = self.__node__("and", node, self._parse_comparison())
         return node
 
     def _parse_comparison(self):
         node = self._parse_primary()
         while self.__peek__()[0] == 'OP':
             op = self.__advance__()[1]
-            right = self._parse_primary()
-            node = self.OperatorEvaluator(node, right, op)
+            node = self.__node__("op", op, node, self._parse_primary())
         return node
 
     def _parse_primary(self):
@@ -97,110 +223,307 @@ class Condition():
             return node
         elif tok_type == 'SIM':
             self.__advance__()
-            arg = re.match(r"sim\('(.*?)'\)", tok_val).group(1)
-            args = [arg]
-            if self.paraphrasings > 0:
-                args += self.paraphraser.paraphrase(self.paraphrasings, arg)
-            return self.SimilarityEvaluator(args, self.embedder)
+            arg = " ".join(re.match(r"sim\('(.*?)'\)", tok_val).group(1).split())
+            return self.__node__("sim", arg, None, None, -1)
         elif tok_type == 'SENT':
             self.__advance__()
-            arg = re.match(r"sent\('(.*?)'\)", tok_val).group(1)
-            return self.SentimentEvaluator(arg, self.sentiment)
+            arg = re.match(r"sent\('(.*?)'\)", tok_val).group(1).strip().lower()
+            return self.__node__("sent", arg)
         elif tok_type == 'FACT':
             self.__advance__()
             arg = re.match(r"fact\('(.*?)'\)", tok_val).group(1)
-            return self.FactEvaluator(arg, self.facts)
+            return self.__node__("fact", arg)
         elif tok_type == 'NUMBER':
             self.__advance__()
-            return self.NumericEvaluator(float(tok_val))
+            return self.__node__("num", float(tok_val))
         else:
             raise SyntaxError(f"Unexpected token: {tok_val}")
 
+    def __similarity_args__(self, arg: str) -> list[str]:
+        args = [arg]
+        if self.paraphrasings > 0:
+            args += self.paraphraser.paraphrase(self.paraphrasings, arg)
+        return args
+
+    # --- COMPILER ---
+    def __compile__(self, node: 'Condition.Evaluator') -> 'Condition.Evaluator':
+        for child in node.children():
+            self.__compile__(child)
+        node.compile()
+        return node
+
     # --------------- Evaluation -------------
 
-    def eval(self, input: str) -> float:
-        return self.expr.eval(input)
+    def dependencies(self) -> list[str]:
+        return sorted(self.expr.fact_keys)
+
+    def eval(self, input: str, analysis: TurnAnalysis = None) -> float:
+        analysis = analysis if analysis != None else TurnAnalysis()
+        skipped = analysis.stats["skipped_leaves"]
+        value = self.expr.evaluate(input, analysis)
+        self.skipped_leaves += analysis.stats["skipped_leaves"] - skipped
+        return value
+
+    def similarity_evaluators(self) -> list['Condition.SimilarityEvaluator']:
+        found = []
+        stack = [self.expr]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, Condition.SimilarityEvaluator):
+                found.append(node)
+            stack.extend(node.children())
+        return found
+
+    def gating_similarity_evaluators(self) -> list['Condition.SimilarityEvaluator']:
+        # sim() leaves reached from the root through `and` alone bound the whole
+        # condition from above, so a low score there means the condition is low too.
+        found = []
+        stack = [self.expr]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, Condition.SimilarityEvaluator):
+                found.append(node)
+            elif isinstance(node, Condition.AndEvaluator):
+                stack.extend(node.children())
+        return found
 
     class Evaluator(ABC):
+        key: str = ""
+        cost: float = 0
+        bounds: tuple[float, float] = (float("-inf"), float("inf"))
+        leaves: int = 1
+        fact_keys: frozenset[str] = frozenset()
+        reads_input: bool = False
+        default_facts: FactSystem = None
+        reactive: bool = False
+        kind: str = None
+
         @abstractmethod
-        def eval(self, input: str) -> float:
+        def eval(self, input: str, analysis: TurnAnalysis) -> float:
             pass
 
-    class OperatorEvaluator(Evaluator):
-        def __init__(self, ev1, ev2, operator: str):
+        def evaluate(self, input: str, analysis: TurnAnalysis) -> float:
+            if tracer.enabled and self.leaves == 1 and self.cost > COST_NUMERIC:
+                return self.__traced__(input, analysis)
+            return self.__evaluate__(input, analysis)
+
+        def __traced__(self, input: str, analysis: TurnAnalysis) -> float:
+            with tracer.span(self.key or type(self).__name__, "condition", chars=len(input)) as span:
+                if self.reactive:
+                    facts = analysis.facts if analysis.facts != None else self.default_facts
+                    cached = isinstance(facts, FactSystem) and facts in self.reactive_cache
+                else:
+                    cached = analysis.has(("node", id(self), input))
+                value = self.__evaluate__(input, analysis)
+                span.set(cached=cached, value=value)
+                return value
+
+        def __evaluate__(self, input: str, analysis: TurnAnalysis) -> float:
+            if self.reactive:
+                return self.__reactive__(input, analysis)
+            # Interned nodes are shared between conditions, so model-backed subtrees are
+            # evaluated once per turn. Fact reads stay live since events can change facts mid-turn.
+            if self.cost < COST_SENTIMENT or self.fact_keys:
+                return self.eval(input, analysis)
+            return analysis.cached(("node", id(self), input), lambda: self.eval(input, analysis))
+
+        def __reactive__(self, input: str, analysis: TurnAnalysis) -> float:
+            # Fact-only subtrees keep their value per fact system until one of the facts
+            # they depend on fires its change callback.
+            facts = analysis.facts if analysis.facts != None else self.default_facts
+            if not isinstance(facts, FactSystem):
+                return self.eval(input, analysis)
+            value = self.reactive_cache.get(facts)
+            if value != None:
+                analysis.count("reactive_hits")
+                return value
+            if facts not in self.reactive_subscribed:
+                self.reactive_subscribed.add(facts)
+                ref = weakref.ref(facts)
+                for key in self.fact_keys:
+                    facts.get_fact(key).add_callback_no_args(
+                        lambda: self.reactive_cache.pop(ref(), None))
+            value = self.eval(input, analysis)
+            self.reactive_cache[facts] = value
+            return value
+
+        def children(self) -> list['Condition.Evaluator']:
+            return []
+
+        def compile(self):
+            self.__compile_reactive__()
+
+        def __compile_reactive__(self):
+            self.reactive = bool(self.fact_keys) and not self.reads_input
+            if self.reactive and not hasattr(self, "reactive_cache"):
+                self.reactive_cache: weakref.WeakKeyDictionary[FactSystem, float] = weakref.WeakKeyDictionary()
+                self.reactive_subscribed: weakref.WeakSet[FactSystem] = weakref.WeakSet()
+
+    class BinaryEvaluator(Evaluator):
+        def __init__(self, ev1, ev2):
             self.ev1 = ev1
             self.ev2 = ev2
+
+        def children(self) -> list['Condition.Evaluator']:
+            return [self.ev1, self.ev2]
+
+        def compile(self):
+            self.cost = self.ev1.cost + self.ev2.cost
+            self.leaves = self.ev1.leaves + self.ev2.leaves
+            self.fact_keys = self.ev1.fact_keys | self.ev2.fact_keys
+            self.reads_input = self.ev1.reads_input or self.ev2.reads_input
+            self.default_facts = self.ev1.default_facts or self.ev2.default_facts
+            self.__compile_reactive__()
+
+        def skip(self, ev: 'Condition.Evaluator', analysis: TurnAnalysis):
+            analysis.count("skipped_leaves", ev.leaves)
+
+    class OperatorEvaluator(BinaryEvaluator):
+        def __init__(self, ev1, ev2, operator: str):
+            super().__init__(ev1, ev2)
             self.operator = operator
+            self.left_first = True
 
-        def eval(self, input: str) -> float:
+        def compile(self):
+            super().compile()
+            self.bounds = (0, 1)
+            self.left_first = self.ev1.cost <= self.ev2.cost
+
+        def compare(self, left: float, right: float) -> int:
             match self.operator:
                 case ">":
-                    return int(self.ev1.eval(input) > self.ev2.eval(input))
+                    return int(left > right)
                 case ">=":
-                    return int(self.ev1.eval(input) >= self.ev2.eval(input))
+                    return int(left >= right)
                 case "<":
-                    return int(self.ev1.eval(input) < self.ev2.eval(input))
+                    return int(left < right)
                 case "<=":
-                    return int(self.ev1.eval(input) <= self.ev2.eval(input))
+                    return int(left <= right)
                 case "==":
-                    return int(self.ev1.eval(input) <= self.ev2.eval(input))
+                    return int(left <= right)
+
+        def eval(self, input: str, analysis: TurnAnalysis) -> float:
+            # Every operator is monotonic in each operand, so if both bounds of the
+            # unevaluated side give the same answer it cannot change the result.
+            if self.left_first:
+                left = self.ev1.evaluate(input, analysis)
+                lo, hi = self.ev2.bounds
+                result = self.compare(left, lo)
+                if result == self.compare(left, hi):
+                    self.skip(self.ev2, analysis)
+                    return result
+                return self.compare(left, self.ev2.evaluate(input, analysis))
+            right = self.ev2.evaluate(input, analysis)
+            lo, hi = self.ev1.bounds
+            result = self.compare(lo, right)
+            if result == self.compare(hi, right):
+                self.skip(self.ev1, analysis)
+                return result
+            return self.compare(self.ev1.evaluate(input, analysis), right)
 
     class NumericEvaluator(Evaluator):
         def __init__(self, value: float):
             self.value = value
+            self.cost = COST_NUMERIC
+            self.bounds = (value, value)
 
-        def eval(self, input: str) -> float:
+        def eval(self, input: str, analysis: TurnAnalysis) -> float:
             return self.value
 
-    class OrEvaluator(Evaluator):
-        def __init__(self, ev1, ev2):
-            self.ev1 = ev1
-            self.ev2 = ev2
+    class OrEvaluator(BinaryEvaluator):
+        def compile(self):
+            super().compile()
+            if self.ev2.cost < self.ev1.cost:
+                self.ev1, self.ev2 = self.ev2, self.ev1
+            self.bounds = (max(self.ev1.bounds[0], self.ev2.bounds[0]),
+                           max(self.ev1.bounds[1], self.ev2.bounds[1]))
 
-        def eval(self, input: str) -> float:
-            return max(self.ev1.eval(input), self.ev2.eval(input))
+        def eval(self, input: str, analysis: TurnAnalysis) -> float:
+            value = self.ev1.evaluate(input, analysis)
+            if value >= self.ev2.bounds[1]:
+                self.skip(self.ev2, analysis)
+                return value
+            return max(value, self.ev2.evaluate(input, analysis))
 
-    class AndEvaluator(Evaluator):
-        def __init__(self, ev1, ev2):
-            self.ev1 = ev1
-            self.ev2 = ev2
+    class AndEvaluator(BinaryEvaluator):
+        def compile(self):
+            super().compile()
+            if self.ev2.cost < self.ev1.cost:
+                self.ev1, self.ev2 = self.ev2, self.ev1
+            self.bounds = (min(self.ev1.bounds[0], self.ev2.bounds[0]),
+                           min(self.ev1.bounds[1], self.ev2.bounds[1]))
 
-        def eval(self, input: str) -> float:
-            return min(self.ev1.eval(input), self.ev2.eval(input))
+        def eval(self, input: str, analysis: TurnAnalysis) -> float:
+            value = self.ev1.evaluate(input, analysis)
+            if value <= self.ev2.bounds[0]:
+                self.skip(self.ev2, analysis)
+                return value
+            return min(value, self.ev2.evaluate(input, analysis))
 
     class SimilarityEvaluator(Evaluator):
-        def __init__(self, args: list[str], embedder: EmbedderWrapper):
+        cost = COST_SIMILARITY
+        kind = "sim"
+        bounds = (0, 1)
+        reads_input = True
+
+        def __init__(self, args: list[str], embedder: EmbedderWrapper, store=None, row: int = -1):
+            # Evaluators loaded from a bundle point at their rows of its shared
+            # matrix, which are stored normalized, instead of owning a copy.
+            self.args = args
             self.embedder = embedder
-            self.arg_embeddings = [embedder.encode(arg) for arg in args]
-
-        def eval(self, input: str) -> float:
-            input_embedding = self.embedder.encode(input)
-            max_score = 0
-            for embedding in self.arg_embeddings:
-                similarity = util.cos_sim(input_embedding, embedding)[0][0]
-                max_score = max(max_score, similarity.item())
+            self.store = store
+            self.row = row
+            if store != None:
+                self.arg_embeddings: torch.Tensor = store.rows(row, len(args), getattr(embedder, "device", "cpu"))
+            else:
+                self.arg_embeddings: torch.Tensor = F.normalize(
+                    torch.stack([embedder.encode_static(arg) for arg in args]), dim=1)
+
+        def eval(self, input: str, analysis: TurnAnalysis) -> float:
+            # Interned leaves are shared between states and rules, so the batch that
+            # scores one comes from whoever is evaluating it, through the analysis.
+            batched = analysis.batches.get(id(self))
+            if batched != None:
+                batch, index = batched
+                max_score = batch.scores(input, analysis)[index]
+            else:
+                input_embedding = F.normalize(
+                    analysis.embedding(self.embedder, input), dim=-1)
+                max_score = max(
+                    0, (self.arg_embeddings @ input_embedding).max().item())
             logger.info(f"Similarity evaluation: {max_score}")
             return max_score
 
     class SentimentEvaluator(Evaluator):
+        cost = COST_SENTIMENT
+        kind = "sent"
+        bounds = (0, 1)
+        reads_input = True
+
         def __init__(self, arg: str, sentiment: SentimentWrapper):
             self.label = arg
             self.sentiment = sentiment
 
-        def eval(self, input: str) -> float:
-            data = self.sentiment.encode(input)
+        def eval(self, input: str, analysis: TurnAnalysis) -> float:
+            data = analysis.sentiment(self.sentiment, input)
             logger.info(f"Sentimental evaluation: {data}")
             if data["label"] == self.label.upper():
                 return data["score"]
             return 0  # 1 - data["score"]
 
     class FactEvaluator(Evaluator):
+        cost = COST_FACT
+        kind = "fact"
+
         def __init__(self, arg: str, facts: FactSystem):
             self.arg = arg
             self.facts = facts
+            self.fact_keys = frozenset([arg])
+            self.default_facts = facts
         
-        def eval(self, input: str) -> float:
-            value = self.facts.get_fact(self.arg).get()
+        def eval(self, input: str, analysis: TurnAnalysis) -> float:
+            facts = analysis.facts if analysis.facts != None else self.facts
+            value = facts.get_fact(self.arg).get()
             if value == None:
                 return 0
             if isinstance(value, numbers.Number):
@@ -209,6 +532,65 @@ class Condition():
                 return 1 if value else 0  
             return 1
 
+class SimilarityBatch:
+    def __init__(self, evaluators: list[Condition.SimilarityEvaluator]):
+        self.embedder = evaluators[0].embedder
+        self.size = len(evaluators)
+        shared = self.__shared__(evaluators)
+        if shared != None:
+            self.matrix, self.segments = shared
+        else:
+            self.matrix: torch.Tensor = torch.cat(
+                [ev.arg_embeddings for ev in evaluators]).contiguous()
+            self.segments: torch.Tensor = torch.cat([
+                torch.full((len(ev.arg_embeddings),), i, dtype=torch.long)
+                for i, ev in enumerate(evaluators)]).to(self.matrix.device)
+        self.members: dict[int, int] = {id(ev): i for i, ev in enumerate(evaluators)}
+        logger.info(
+            f"Similarity batch: {self.size} conditions, {self.matrix.shape[0]} anchors")
+
+    def __shared__(self, evaluators: list[Condition.SimilarityEvaluator]) -> tuple[torch.Tensor, torch.Tensor]:
+        # Conditions of one config are compiled into neighbouring bundle rows, so the
+        # batch can usually score a slice of the shared matrix rather than a copy.
+        # Rows in the slice that belong to other batches go to a dropped segment.
+        store = evaluators[0].store
+        if store == None or any(ev.store != store for ev in evaluators):
+            return None
+        start = min(ev.row for ev in evaluators)
+        end = max(ev.row + len(ev.args) for ev in evaluators)
+        if end - start > 2 * sum(len(ev.args) for ev in evaluators):
+            return None
+        matrix = store.rows(start, end - start, getattr(self.embedder, "device", "cpu"))
+        segments = torch.full((end - start,), self.size, dtype=torch.long)
+        for i, ev in enumerate(evaluators):
+            segments[ev.row - start:ev.row - start + len(ev.args)] = i
+        return matrix, segments.to(matrix.device)
+
+    @staticmethod
+    def from_conditions(conditions: list[Condition]) -> list['SimilarityBatch']:
+        groups: dict[int, dict[int, Condition.SimilarityEvaluator]] = {}
+        for condition in conditions:
+            for ev in condition.similarity_evaluators():
+                groups.setdefault(id(ev.embedder), {})[id(ev)] = ev
+        return [SimilarityBatch(list(evs.values())) for evs in groups.values()]
+
+    @staticmethod
+    def lookup(batches: list['SimilarityBatch']) -> dict[int, tuple['SimilarityBatch', int]]:
+        return {member: (batch, index) for batch in batches for member, index in batch.members.items()}
+
+    def scores(self, input: str, analysis: TurnAnalysis) -> list[float]:
+        return analysis.cached(("similarity", id(self), input), lambda: self.__score__(input, analysis))
+
+    def __score__(self, input: str, analysis: TurnAnalysis) -> list[float]:
+        input_embedding = F.normalize(
+            analysis.embedding(self.embedder, input), dim=-1).to(self.matrix.device)
+        similarities = self.matrix @ input_embedding
+        scores = torch.zeros(self.size + 1, dtype=similarities.dtype, device=similarities.device)
+        scores = scores.scatter_reduce(
+            0, self.segments, similarities, reduce="amax", include_self=True)
+        return scores[:self.size].tolist()
+
+
 # if __name__ == "__main__":
 #     sentiment = pipeline("sentiment-analysis")
 #     embedder = SentenceTransformer("stsb-roberta-large")
@@ -1,5 +1,10 @@
+from analysis import TurnAnalysis
+from session import Session
+from facts import FactSystem
+
+
 class Container:
-    def __init__(self, input: str = "", history: list[str] = None, urgency: float = 0.5, freedom: float = 0.5, facts: list[str] = None, instructions: list[str]  = None, personality: list[str]  = None):
+    def __init__(self, input: str = "", history: list[str] = None, urgency: float = 0.5, freedom: float = 0.5, facts: list[str] = None, instructions: list[str]  = None, personality: list[str]  = None, analysis: TurnAnalysis = None, session: Session = None):
         self.input: str = input
         self.history: list[str] = history if history != None else []
         self.urgency: float = urgency
@@ -7,6 +12,11 @@ class Container:
         self.facts: list[str] = facts if facts != None else []
         self.instructions: list[str] = instructions if instructions != None else []
         self.personality: list[str] = personality if personality != None else []
+        self.session: Session = session if session != None else Session(None, self.history)
+        self.analysis: TurnAnalysis = analysis if analysis != None else TurnAnalysis(self.session.facts)
+
+    def fact_system(self, default: FactSystem) -> FactSystem:
+        return self.session.facts if self.session.facts != None else default
 
     def __str__(self):
         return (
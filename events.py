@@ -1,17 +1,72 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import Callable, Dict, List
 import logging
+import threading
+import time
 logger = logging.getLogger(__name__)
 
+MODE_SYNC = "sync"
+MODE_ASYNC = "async"
 
-class EventSystem:
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP = "drop"
+OVERFLOW_SYNC = "sync"
+
+
+class HandlerStats:
     def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def record(self, latency: float, failed: bool):
+        self.calls += 1
+        self.errors += failed
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    def to_dict(self) -> dict[str, float]:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "mean_latency": self.total_latency / self.calls if self.calls else 0,
+            "max_latency": self.max_latency,
+        }
+
+
+class EventSystem:
+    def __init__(self, mode: str = MODE_SYNC, workers: int = 4, max_pending: int = 1024, overflow: str = OVERFLOW_BLOCK):
         self.events: Dict[str, List[Callable[[], None]]] = {}
+        self.mode = mode
+        self.max_pending = max_pending
+        self.overflow = overflow
+        self.stats: Dict[str, HandlerStats] = {}
+        self.counters = {"queued": 0, "coalesced": 0, "dropped": 0}
+        # Handlers that must finish before the turn continues, even in async mode.
+        self._sync: Dict[str, List[Callable[[], None]]] = {}
+        # Each event has its own queue of (turn, handlers) drained by at most one
+        # worker at a time, so invocations of one event run in order.
+        self._queues: Dict[str, deque] = {}
+        self._active: set[str] = set()
+        self._pending = 0
+        # Turn counters per session, so one player's turn ending or invoking an event
+        # never coalesces away another player's invocation. A session's counter only
+        # lives while it has invocations queued, counted in _queued.
+        self._turns: Dict[str, int] = {}
+        self._queued: Dict[str, int] = {}
+        self._closed = False
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="events") if mode == MODE_ASYNC else None
 
-    def add_evt(self, evt_name: str, action: Callable[[], None]):
+    def add_evt(self, evt_name: str, action: Callable[[], None], sync: bool = False):
         if evt_name not in self.events:
             self.events[evt_name] = []
         if action not in self.events[evt_name]:
             self.events[evt_name].append(action)
+            if sync:
+                self._sync.setdefault(evt_name, []).append(action)
             logger.debug(f"Added action to event '{evt_name}'")
         else:
             logger.debug(f"Action already registered to event '{evt_name}'")
@@ -19,20 +74,124 @@ class EventSystem:
     def remove_evt(self, evt_name: str, action: Callable[[], None]):
         if evt_name in self.events and action in self.events[evt_name]:
             self.events[evt_name].remove(action)
+            if action in self._sync.get(evt_name, []):
+                self._sync[evt_name].remove(action)
             logger.debug(f"Removed action from event '{evt_name}'")
             if not self.events[evt_name]:
                 del self.events[evt_name]
+                self._sync.pop(evt_name, None)
                 logger.debug(
                     f"Removed event '{evt_name}' as it has no more actions")
 
-    def invoke(self, evt_name: str):
+    def invoke(self, evt_name: str, session_id: str = None):
         if evt_name == None or evt_name == '':
             return
         logger.info(f"Event invoked: '{evt_name}'")
-        if evt_name in self.events:
-            for action in self.events[evt_name]:
-                try:
-                    action()
-                except Exception as e:
-                    logger.error(
-                        f"Error invoking action for event '{evt_name}': {e}")
\ No newline at end of file
+        if evt_name not in self.events:
+            return
+        if self._executor == None or self._closed:
+            self.__run__(evt_name, list(self.events[evt_name]))
+            return
+        sync = self._sync.get(evt_name, [])
+        if sync:
+            self.__run__(evt_name, list(sync))
+        queued = [action for action in self.events[evt_name] if action not in sync]
+        if queued:
+            self.__enqueue__(evt_name, queued, session_id)
+
+    def end_turn(self, session_id: str = None):
+        # Duplicate invocations are only coalesced within one turn of one session.
+        with self._cond:
+            if self._queued.get(session_id):
+                self._turns[session_id] = self._turns.get(session_id, 0) + 1
+            else:
+                self._turns.pop(session_id, None)
+
+    def flush(self, timeout: float = None) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pending == 0, timeout)
+
+    def close(self):
+        # Events invoked after closing run inline.
+        if self._executor != None and not self._closed:
+            with self._cond:
+                self._closed = True
+            self.flush()
+            self._executor.shutdown()
+
+    def to_dict(self) -> dict[str, any]:
+        return {
+            **self.counters,
+            "pending": self._pending,
+            "handlers": {name: stats.to_dict() for name, stats in self.stats.items()},
+        }
+
+    def __enqueue__(self, evt_name: str, actions: List[Callable[[], None]], session_id: str = None):
+        with self._cond:
+            queue = self._queues.setdefault(evt_name, deque())
+            # A queued invocation from this session's turn that has not started yet
+            # already covers this one, since events carry no arguments.
+            turn = (session_id, self._turns.get(session_id, 0))
+            if queue and queue[-1][0] == turn:
+                self.counters["coalesced"] += 1
+                return
+            if self._closed:
+                run_inline = True
+            elif self._pending >= self.max_pending:
+                if self.overflow == OVERFLOW_DROP:
+                    self.counters["dropped"] += 1
+                    logger.warning(f"Event queue is full, dropping '{evt_name}'")
+                    return
+                if self.overflow == OVERFLOW_SYNC:
+                    run_inline = True
+                else:
+                    self._cond.wait_for(lambda: self._pending < self.max_pending or self._closed)
+                    run_inline = self._closed
+            else:
+                run_inline = False
+            if not run_inline:
+                queue.append((turn, actions))
+                self._queued[session_id] = self._queued.get(session_id, 0) + 1
+                self._pending += 1
+                self.counters["queued"] += 1
+                if evt_name not in self._active:
+                    self._active.add(evt_name)
+                    self._executor.submit(self.__drain__, evt_name)
+                return
+        if not self._closed:
+            logger.warning(f"Event queue is full, running '{evt_name}' inline")
+        self.__run__(evt_name, actions)
+
+    def __drain__(self, evt_name: str):
+        queue = self._queues[evt_name]
+        while True:
+            with self._cond:
+                if not queue:
+                    self._active.discard(evt_name)
+                    return
+                (session_id, _), actions = queue.popleft()
+                self._queued[session_id] -= 1
+                if not self._queued[session_id]:
+                    del self._queued[session_id]
+                    self._turns.pop(session_id, None)
+            self.__run__(evt_name, actions)
+            with self._cond:
+                self._pending -= 1
+                self._cond.notify_all()
+
+    def __run__(self, evt_name: str, actions: List[Callable[[], None]]):
+        for action in actions:
+            start = time.perf_counter()
+            failed = False
+            try:
+                action()
+            except Exception as e:
+                failed = True
+                logger.error(
+                    f"Error invoking action for event '{evt_name}': {e}")
+            name = f"{evt_name}:{getattr(action, '__qualname__', repr(action))}"
+            with self._cond:
+                stats = self.stats.get(name)
+                if stats == None:
+                    stats = self.stats[name] = HandlerStats()
+                stats.record(time.perf_counter() - start, failed)
@@ -1,5 +1,7 @@
 import logging
-from typing import Any, Callable, Dict, List, Generic, TypeVar
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Generic, Optional, TypeVar
 
 logger = logging.getLogger(__name__)
 
@@ -7,17 +9,27 @@ T = TypeVar('T')
 
 
 class Fact(Generic[T]):
-    def __init__(self, initial_value: T = None):
+    __slots__ = ("key", "value", "version", "_system", "_callbacks_no_args",
+                 "_callbacks_new_value", "_callbacks_old_new")
+
+    def __init__(self, initial_value: T = None, key: str = None, system: Optional['FactSystem'] = None):
+        self.key = key
         self.value = initial_value
+        self.version = 0
+        self._system = system
         self._callbacks_no_args: List[Callable[[], None]] = []
         self._callbacks_new_value: List[Callable[[T], None]] = []
         self._callbacks_old_new: List[Callable[[T, T], None]] = []
 
     def set(self, new_value: T):
         if new_value != self.value:
+            if self._system != None:
+                self._system.__assign__(self, new_value)
+                return
             old_value = self.value
             self.value = new_value
-            logger.info(f"Fact updated: {old_value} -> {new_value}")
+            self.version += 1
+            logger.debug("Fact updated: %s -> %s", old_value, new_value)
             self.__invoke_callbacks__(old_value, new_value)
 
     def get(self) -> T:
@@ -60,19 +72,126 @@ class Fact(Generic[T]):
 
 
 class FactSystem:
-    def __init__(self):
+    def __init__(self, max_log: int = 100000):
         self._facts: Dict[str, Fact] = {}
+        self.version = 0
+        self.max_log = max_log
+        # Change log of (version, key, old value), oldest first. snapshot/diff/restore
+        # walk it backwards, so they cost O(changes since the snapshot).
+        self._log: List[tuple[int, str, Any]] = []
+        self._horizon = 0
+        self._pending: Optional[Dict[Fact, Any]] = None
+        self._depth = 0
+        self._lock = threading.RLock()
 
     def set_fact(self, key: str, value: Any):
-        if key not in self._facts:
-            self._facts[key] = Fact(value)
-        else:
-            self._facts[key].set(value)
+        with self._lock:
+            fact = self._facts.get(key)
+            if fact == None:
+                self._facts[key] = fact = Fact(None, key, self)
+                if value == None:
+                    return
+            fact.set(value)
+
+    def set_many(self, values: Dict[str, Any]):
+        with self.transaction():
+            for key, value in values.items():
+                self.set_fact(key, value)
+
+    @contextmanager
+    def transaction(self):
+        # Changes inside a transaction share one version and fire each fact's callbacks
+        # once, with the value from before the transaction and the final value.
+        with self._lock:
+            if self._depth == 0:
+                self._pending = {}
+            self._depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._depth -= 1
+                if self._depth == 0:
+                    for fact, old_value in self._pending.items():
+                        fact.value = old_value
+                    self._pending = None
+                raise
+            self._depth -= 1
+            if self._depth == 0:
+                pending, self._pending = self._pending, None
+                self.__commit__(pending)
 
     def get_fact(self, key: str) -> Fact[Any]:
-        if key in self._facts:
-            return self._facts.get(key).get()
-        else:
-            fact = Fact()
-            self._facts[key] = fact
-            return fact
\ No newline at end of file
+        fact = self._facts.get(key)
+        if fact == None:
+            with self._lock:
+                fact = self._facts.setdefault(key, Fact(None, key, self))
+        return fact
+
+    def get_value(self, key: str, default: Any = None) -> Any:
+        fact = self._facts.get(key)
+        return fact.value if fact != None and fact.value != None else default
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {key: fact.get() for key, fact in self._facts.items()}
+
+    def fork(self) -> 'FactSystem':
+        # A new system starting from the current values, e.g. one per player session;
+        # callbacks stay with this one.
+        system = FactSystem(self.max_log)
+        with self._lock:
+            system.set_many({key: value for key, value in self.to_dict().items() if value != None})
+        return system
+
+    def snapshot(self) -> int:
+        return self.version
+
+    def diff(self, since: int) -> Dict[str, Any]:
+        with self._lock:
+            self.__check_horizon__(since)
+            changed = {}
+            for version, key, _ in reversed(self._log):
+                if version <= since:
+                    break
+                changed.setdefault(key, self._facts[key].value)
+            return changed
+
+    def restore(self, snapshot: int):
+        with self._lock:
+            self.__check_horizon__(snapshot)
+            values = {}
+            for version, key, old_value in reversed(self._log):
+                if version <= snapshot:
+                    break
+                values[key] = old_value
+            self.set_many(values)
+
+    def __check_horizon__(self, version: int):
+        if version < self._horizon:
+            raise ValueError(
+                f"Version {version} is older than the fact log horizon {self._horizon}")
+
+    def __assign__(self, fact: Fact, new_value: Any):
+        with self._lock:
+            if self._pending != None:
+                self._pending.setdefault(fact, fact.value)
+                fact.value = new_value
+                return
+            old_value = fact.value
+            fact.value = new_value
+            self.__commit__({fact: old_value})
+
+    def __commit__(self, pending: Dict[Fact, Any]):
+        changed = [(fact, old_value) for fact, old_value in pending.items() if fact.value != old_value]
+        if not changed:
+            return
+        self.version += 1
+        for fact, old_value in changed:
+            fact.version = self.version
+            self._log.append((self.version, fact.key, old_value))
+        if len(self._log) > self.max_log:
+            trimmed = len(self._log) - self.max_log // 2
+            self._horizon = self._log[trimmed - 1][0]
+            del self._log[:trimmed]
+        logger.debug("Facts updated to version %d: %d changed", self.version, len(changed))
+        for fact, old_value in changed:
+            fact.__invoke_callbacks__(old_value, fact.value)
@@ -10,6 +10,8 @@ from container import Container
 
 logger = logging.getLogger(__name__)
 
+SESSION_STATE_KEY = "fsm.current_state"
+
 
 class FSMDialogueFlowModule(DialogueFlowModuleBase):
     def __init__(self, config_file: str, embedder: EmbedderWrapper, sentiment: SentimentWrapper, paraphraser: ParaphraserWrapper, facts: FactSystem, events: EventSystem, threshold: float = 0.4, min_diff=0.1, paraphrasings: int = 0):
@@ -23,17 +25,18 @@ class FSMDialogueFlowModule(DialogueFlowModuleBase):
             self.states[name] = State.from_dict(
                 name, state, embedder, sentiment, paraphraser, facts, paraphrasings)
         logger.info(f"Loaded states: {self.states}")
-        self.current_state = self.state_machine.get(
+        self.initial_state = self.state_machine.get(
             "initial_state", next(iter(self.states.keys())))
-        logger.info(f"Start state: {self.current_state}")        
+        logger.info(f"Start state: {self.initial_state}")
 
-    def get_state(self) -> State:
-        return self.states[self.current_state]
+    def get_state(self, container: Container) -> State:
+        return self.states[container.session.data.get(SESSION_STATE_KEY, self.initial_state)]
 
     def process(self, container: Container):
-        state = self.get_state()
-        transitions = [(t.to, t.evaluator.eval(container.input), t)
-                       for t in state.transitions]
+        state = self.get_state(container)
+        with container.analysis.scoring(state.batches):
+            transitions = [(t.to, t.evaluator.eval(container.input, container.analysis), t)
+                           for t in state.transitions]
         transitions = sorted(transitions, key=lambda x: x[1], reverse=True)
         logger.info(f"Possible transitions: {transitions}")
         transition: tuple[str, float, Transition] = None
@@ -50,11 +53,11 @@ class FSMDialogueFlowModule(DialogueFlowModuleBase):
             container.instructions.append(state.template)
         else:
             logger.info(f"Transition to: {transition}")
-            self.events.invoke(self.get_state().on_exit)
-            self.current_state = transition[0]
+            self.events.invoke(state.on_exit, container.session.id)
+            container.session.data[SESSION_STATE_KEY] = transition[0]
             container.freedom = transition[2].freedom
             container.urgency = transition[2].urgency
-            self.events.invoke(transition[2].on_enter)
+            self.events.invoke(transition[2].on_enter, container.session.id)
             container.instructions.append(transition[2].template)
-            container.instructions.append(self.get_state().template)
-            self.events.invoke(self.get_state().on_enter)
+            container.instructions.append(self.get_state(container).template)
+            self.events.invoke(self.get_state(container).on_enter, container.session.id)
@@ -1,21 +1,33 @@
+import heapq
+import itertools
 import logging
-from typing import List, Dict, Optional
-from facts import FactSystem
+import math
+from typing import Any, Hashable, Iterable, List, Dict, Optional
+from facts import Fact, FactSystem
 from events import EventSystem
 from container import Container
 from flow.dialogue import DialogueFlowModuleBase
 from wrappers import EmbedderWrapper, ParaphraserWrapper, SentimentWrapper
 from condition import Condition
+from templates import compile_template
+from analysis import TurnAnalysis
 import loader
 
 logger = logging.getLogger(__name__)
 
+SESSION_PLAN_KEY = "goap.current_plan"
+
 class Action:
-    def __init__(self, name, preconditions, effects, template, evaluator, on_success=None, on_fail=None):
+    def __init__(self, name, preconditions, effects, template, evaluator, on_success=None, on_fail=None, cost=1, events=None):
         self.name = name
         self.preconditions: List[Condition] = preconditions
-        self.effects: List[str] = effects
+        # Dict effects are fact assignments the planner can reason about; list effects
+        # are event names, as in older configs.
+        self.effects: Dict[str, Any] = effects if isinstance(effects, dict) else {}
+        self.events: List[str] = list(events or []) + (list(effects) if isinstance(effects, list) else [])
+        self.cost = cost
         self.template = template
+        compile_template(template)
         self.evaluator = evaluator
         self.on_success = on_success
         self.on_fail = on_fail
@@ -32,42 +44,237 @@ class Action:
                                 embedder, sentiment, paraphraser, facts, paraphrasings),
             on_success=data.get('on_success'),
             on_fail=data.get('on_fail'),
+            cost=data.get('cost', 1),
+            events=data.get('events'),
         )
 
-    def is_applicable(self) -> bool:
-        return all(p.eval('') for p in self.preconditions)
+    def is_applicable(self, analysis: TurnAnalysis = None) -> bool:
+        return all(p.eval('', analysis) for p in self.preconditions)
+
+    def dependencies(self) -> set[str]:
+        return {key for p in self.preconditions for key in p.dependencies()}
 
-    def apply_effects(self, events: EventSystem):
-        for e in self.effects:
-            events.invoke(e)
+    def apply_effects(self, events: EventSystem, facts: FactSystem = None, session_id: str = None):
+        if facts != None and self.effects:
+            facts.set_many(self.effects)
+        for e in self.events:
+            events.invoke(e, session_id)
 
-    def execute(self, container: Container, events: EventSystem) -> bool:
-        if self.evaluator.eval(container.input):
-            self.apply_effects(events)
+    def execute(self, container: Container, events: EventSystem, facts: FactSystem = None) -> bool:
+        if self.evaluator.eval(container.input, container.analysis):
+            self.apply_effects(events, facts, container.session.id)
             return True
         return False
 
+
+def freeze(value: Any) -> Hashable:
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return repr(value)
+
+
+class PlannedFacts:
+    # Read-only fact view of a hypothetical planning state. It is not a FactSystem, so
+    # preconditions evaluated against it bypass the reactive condition caches.
+    def __init__(self, domain: 'PlanningDomain', state: tuple, facts: FactSystem):
+        self.domain = domain
+        self.state = state
+        self.facts = facts
+
+    def get_fact(self, key: str) -> Fact:
+        index = self.domain.index.get(key)
+        if index == None:
+            return self.facts.get_fact(key)
+        return Fact(self.state[index], key)
+
+
+class PlanningDomain:
+    # A goal's view of the actions. Only actions that can lead to the goal are kept:
+    # those setting a goal fact, or a fact another kept action's preconditions read.
+    # States are tuples of just those facts, so they hash cheaply and key the plan cache.
+    def __init__(self, actions: List[Action], goal: dict, max_applicable: int):
+        keys = set(goal)
+        relevant: List[Action] = []
+        remaining = [a for a in actions if a.effects]
+        while True:
+            added = [a for a in remaining if keys & set(a.effects)]
+            if not added:
+                break
+            for action in added:
+                keys.update(action.dependencies())
+            relevant += added
+            remaining = [a for a in remaining if a not in added]
+        self.actions = relevant
+        for action in relevant:
+            keys.update(action.effects)
+        self.keys: tuple[str, ...] = tuple(sorted(keys))
+        self.index = {key: i for i, key in enumerate(self.keys)}
+        self.goal = [(self.index[k], freeze(v)) for k, v in goal.items()]
+        self.goal_key = tuple(sorted((k, freeze(v)) for k, v in goal.items()))
+        self.effects = {a.name: [(self.index[k], freeze(v)) for k, v in a.effects.items()] for a in relevant}
+        # Heuristic tables: a fact is achieved when it equals its goal value, or for
+        # facts read by preconditions, when it is truthy.
+        self.targets = dict(self.goal)
+        self.achievers: dict[int, list[tuple[float, list[int]]]] = {}
+        for action in relevant:
+            requires = [self.index[k] for k in action.dependencies()]
+            for i, v in self.effects[action.name]:
+                if v == self.targets[i] if i in self.targets else v:
+                    self.achievers.setdefault(i, []).append((action.cost, requires))
+        self.max_applicable = max_applicable
+        self._applicable: dict[tuple[str, tuple], bool] = {}
+        logger.info(f"Planning domain for {self.goal_key}: {len(relevant)} of {len(actions)} actions, {len(self.keys)} facts")
+
+    def state(self, facts: FactSystem) -> tuple:
+        return tuple(freeze(facts.get_fact(key).get()) for key in self.keys)
+
+    def satisfied(self, state: tuple) -> bool:
+        return all(state[i] == v for i, v in self.goal)
+
+    def heuristic(self, state: tuple) -> float:
+        # Additive relaxed cost: each unmet goal fact costs its cheapest achiever plus
+        # the relaxed cost of the facts that achiever's preconditions read. Shared
+        # subgoals are counted more than once, so plans are near-optimal, not optimal.
+        costs: dict[int, float] = {}
+
+        def cost(i: int) -> float:
+            if i in costs:
+                return costs[i]
+            # Facts nothing sets are only checked by the preconditions themselves.
+            if ((state[i] == self.targets[i]) if i in self.targets else state[i]) or i not in self.achievers:
+                costs[i] = 0 if i not in self.targets or state[i] == self.targets[i] else math.inf
+                return costs[i]
+            costs[i] = math.inf
+            best = math.inf
+            for action_cost, requires in self.achievers.get(i, []):
+                best = min(best, action_cost + sum(cost(r) for r in requires))
+            costs[i] = best
+            return best
+
+        return sum(cost(i) for i, _ in self.goal)
+
+    def apply(self, state: tuple, action: Action) -> tuple:
+        values = list(state)
+        for i, v in self.effects[action.name]:
+            values[i] = v
+        return tuple(values)
+
+    def applicable(self, action: Action, state: tuple, facts: FactSystem) -> bool:
+        # Preconditions only read facts in the state tuple, so results are memoized per state.
+        key = (action.name, state)
+        result = self._applicable.get(key)
+        if result == None:
+            if len(self._applicable) >= self.max_applicable:
+                self._applicable.clear()
+            result = action.is_applicable(TurnAnalysis(PlannedFacts(self, state, facts)))
+            self._applicable[key] = result
+        return result
+
+
 class GOAPPlanner:
-    def __init__(self, actions: Dict[str, Action]):
+    def __init__(self, actions: Dict[str, Action], max_expansions: int = 10000, max_plans: int = 65536):
         self.actions = actions
+        self.max_expansions = max_expansions
+        self.max_plans = max_plans
+        self._domains: dict[tuple, PlanningDomain] = {}
+        self._plans: dict[tuple, Optional[tuple[str, ...]]] = {}
+        self.stats = {"searches": 0, "expansions": 0, "cache_hits": 0, "suffix_hits": 0, "exhausted": 0}
 
-    def plan(self, facts: FactSystem, goal: dict) -> Optional[List[Action]]:
-        plan = []
-        state = {k: facts.get_fact(k) for k in goal.keys()}
+    def plan(self, facts: FactSystem, goal: dict, avoid: Iterable[str] = ()) -> Optional[List[Action]]:
+        # Plans are cached by (goal, fact state). Avoided actions are excluded from the
+        # first step only, which is how a failed step is replanned around.
+        domain = self.__domain__(goal)
+        start = domain.state(facts)
+        avoid = frozenset(avoid)
+        key = (domain.goal_key, start)
+        if not avoid and key in self._plans:
+            self.stats["cache_hits"] += 1
+            names = self._plans[key]
+            return None if names == None else [self.actions[name] for name in names]
 
-        while not self._goal_met(state, goal):
-            applicable = [a for a in self.actions.values() if a.is_applicable()]
-            if not applicable:
-                return None
+        names, exhausted = self.__search__(domain, start, facts, avoid)
+        # Running out of budget says nothing about reachability, so it isn't cached.
+        if exhausted:
+            return None
+        if not avoid:
+            self.__store__(domain, start, names)
+        elif names != None:
+            self.__store__(domain, domain.apply(start, self.actions[names[0]]), names[1:])
+        return None if names == None else [self.actions[name] for name in names]
 
-            action = applicable[0]
-            plan.append(action)
-            for k, v in action.effects.items():
-                state[k] = v
-        return plan
+    def __domain__(self, goal: dict) -> PlanningDomain:
+        key = tuple(sorted((k, freeze(v)) for k, v in goal.items()))
+        domain = self._domains.get(key)
+        if domain == None:
+            domain = PlanningDomain(list(self.actions.values()), goal, self.max_plans)
+            self._domains[key] = domain
+        return domain
 
-    def _goal_met(self, state: dict, goal: dict) -> bool:
-        return all(state.get(k) == v for k, v in goal.items())
+    def __search__(self, domain: PlanningDomain, start: tuple, facts: FactSystem, avoid: frozenset) -> tuple[Optional[tuple[str, ...]], bool]:
+        self.stats["searches"] += 1
+        counter = itertools.count()
+        # Ties on f are broken towards lower h, i.e. states closer to the goal.
+        estimate = domain.heuristic(start)
+        frontier = [(estimate, estimate, 0, next(counter), start)]
+        costs = {start: 0}
+        parents: dict[tuple, tuple[tuple, str]] = {}
+        expansions = 0
+        while frontier:
+            _, _, cost, _, state = heapq.heappop(frontier)
+            if cost > costs[state]:
+                continue
+            if domain.satisfied(state):
+                return self.__path__(parents, state), False
+            if state != start:
+                # A plan cached from an earlier search finishes this one.
+                suffix = self._plans.get((domain.goal_key, state))
+                if suffix != None:
+                    self.stats["suffix_hits"] += 1
+                    return self.__path__(parents, state) + suffix, False
+            if expansions >= self.max_expansions:
+                self.stats["exhausted"] += 1
+                logger.warning(f"Planner expansion budget of {self.max_expansions} exhausted")
+                return None, True
+            expansions += 1
+            self.stats["expansions"] += 1
+            for action in domain.actions:
+                if state == start and action.name in avoid:
+                    continue
+                successor = domain.apply(state, action)
+                if successor == state:
+                    continue
+                successor_cost = cost + action.cost
+                if successor_cost >= costs.get(successor, math.inf):
+                    continue
+                if not domain.applicable(action, state, facts):
+                    continue
+                costs[successor] = successor_cost
+                parents[successor] = (state, action.name)
+                estimate = domain.heuristic(successor)
+                heapq.heappush(frontier, (successor_cost + estimate, estimate, successor_cost, next(counter), successor))
+        return None, False
+
+    def __path__(self, parents: dict, state: tuple) -> tuple[str, ...]:
+        names = []
+        while state in parents:
+            state, name = parents[state]
+            names.append(name)
+        return tuple(reversed(names))
+
+    def __store__(self, domain: PlanningDomain, state: tuple, names: Optional[tuple[str, ...]]):
+        # Every state along a plan gets its remaining suffix, so following the plan and
+        # replanning from any step along it are cache hits.
+        if len(self._plans) >= self.max_plans:
+            logger.info(f"Plan cache is full, clearing {len(self._plans)} plans")
+            self._plans.clear()
+        self._plans[(domain.goal_key, state)] = names
+        if names == None:
+            return
+        for i, name in enumerate(names):
+            state = domain.apply(state, self.actions[name])
+            self._plans.setdefault((domain.goal_key, state), names[i + 1:])
 
 
 class GOAPDialogueFlowModule(DialogueFlowModuleBase):
@@ -83,37 +290,50 @@ class GOAPDialogueFlowModule(DialogueFlowModuleBase):
                 action_data, embedder, sentiment, paraphraser, facts)
 
         self.goal = self.config["goal"]
-        self.planner = GOAPPlanner(self.actions)
-        self.current_plan: Optional[List[Action]] = []
+        self.planner = GOAPPlanner(self.actions, self.config.get("max_expansions", 10000))
         logger.info(f"GOAP system initialized with {len(self.actions)} actions and goal: {self.goal}")
 
+    def get_plan(self, container: Container) -> List[Action]:
+        return [self.actions[name] for name in container.session.data.get(SESSION_PLAN_KEY, [])]
+
+    def set_plan(self, container: Container, plan: Optional[List[Action]]):
+        container.session.data[SESSION_PLAN_KEY] = [a.name for a in plan or []]
+
     def process(self, container: Container):
-        if not self.current_plan:
+        facts = container.fact_system(self.facts)
+        current_plan = self.get_plan(container)
+        if not current_plan:
             logger.info("Planning new goal path...")
-            self.current_plan = self.planner.plan(self.facts, self.goal)
-            if not self.current_plan:
+            current_plan = self.planner.plan(facts, self.goal)
+            self.set_plan(container, current_plan)
+            if current_plan == None:
                 logger.warning("Planning failed. No valid path to goal.")
                 container.instructions.append("I can't help you right now.")
                 return
+            if not current_plan:
+                logger.info("Goal already achieved.")
+                return
 
-        current_action = self.current_plan[0]
+        current_action = current_plan[0]
         logger.info(f"Executing action: {current_action.name}")
 
         try:
-            success = current_action.execute(container, self.events)
+            success = current_action.execute(container, self.events, facts)
         except Exception as e:
             logger.error(f"Action '{current_action.name}' failed with error: {e}")
             success = False
 
         if success:
             logger.info(f"Action '{current_action.name}' succeeded.")
-            self.events.invoke(current_action.on_success)
-            self.current_plan.pop(0)
+            self.events.invoke(current_action.on_success, container.session.id)
+            current_plan.pop(0)
             container.instructions.append(current_action.template)
         else:
             logger.warning(f"Action '{current_action.name}' failed. Replanning...")
-            self.events.invoke(current_action.on_fail)
-            self.current_plan = self.planner.plan(self.facts, self.goal)
+            self.events.invoke(current_action.on_fail, container.session.id)
+            current_plan = (self.planner.plan(facts, self.goal, avoid=[current_action.name])
+                            or self.planner.plan(facts, self.goal))
+        self.set_plan(container, current_plan)
 
-        if not self.current_plan:
+        if not current_plan:
             logger.info("Goal achieved or no further actions.")
\ No newline at end of file
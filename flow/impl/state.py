@@ -1,5 +1,7 @@
 import logging
 from facts import FactSystem
+from condition import SimilarityBatch
+from templates import compile_template
 from flow.impl.transition import Transition
 from wrappers import EmbedderWrapper, ParaphraserWrapper, SentimentWrapper
 
@@ -10,10 +12,14 @@ class State:
         self.urgency: float = urgency
         self.freedom: float = freedom
         self.template: str = template
+        compile_template(template)
         self.name: str = name
         self.transitions: list[Transition] = transitions
         self.on_enter: str = on_enter
         self.on_exit: str = on_exit
+        self.similarity: list[SimilarityBatch] = SimilarityBatch.from_conditions(
+            [t.evaluator for t in transitions])
+        self.batches = SimilarityBatch.lookup(self.similarity)
 
     @staticmethod
     def from_dict(name: str, data: dict, embedder: EmbedderWrapper, sentiment: SentimentWrapper, paraphraser: ParaphraserWrapper, facts: FactSystem, paraphrasings: int = 0):
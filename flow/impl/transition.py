@@ -1,5 +1,6 @@
 import logging
 from condition import Condition
+from templates import compile_template
 from facts import FactSystem
 from wrappers import EmbedderWrapper, ParaphraserWrapper, SentimentWrapper
 
@@ -12,6 +13,7 @@ class Transition:
         self.freedom: float = freedom
         self.to: str = to
         self.template: str = template
+        compile_template(template)
         self.evaluator: Condition = evaluator
         self.on_enter: str = on_enter
 
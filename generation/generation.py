@@ -1,5 +1,6 @@
 import logging
 from abc import ABC, abstractmethod
+from typing import Iterator
 from container import Container
 
 logger = logging.getLogger(__name__)
@@ -7,5 +8,8 @@ logger = logging.getLogger(__name__)
 
 class GenerationModuleBase(ABC):
     @abstractmethod
-    def generate(container: Container) -> str:
+    def generate(self, container: Container) -> str:
         pass
+
+    def generate_stream(self, container: Container) -> Iterator[str]:
+        yield self.generate(container)
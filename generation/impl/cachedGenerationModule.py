@@ -0,0 +1,126 @@
+import json
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterator
+import torch
+import torch.nn.functional as F
+from cache import cache_key
+from container import Container
+from generation.generation import GenerationModuleBase
+from wrappers import EmbedderWrapper
+
+logger = logging.getLogger(__name__)
+
+
+class CachedResponse:
+    def __init__(self, embedding: torch.Tensor, response: str):
+        self.embedding = embedding
+        self.responses: list[str] = [response]
+        self.created = time.monotonic()
+
+
+class CachedGenerationModule(GenerationModuleBase):
+    def __init__(self, generation: GenerationModuleBase, embedder: EmbedderWrapper, npc: str = "", threshold: float = 0.9, max_entries: int = 1024, ttl: float = 600, variety: int = 1):
+        self.generation = generation
+        self.embedder = embedder
+        self.npc = npc
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.variety = variety
+        self.buckets: OrderedDict[str, list[CachedResponse]] = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def stats(self) -> dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0,
+            "entries": self.size,
+            "evictions": self.evictions,
+        }
+
+    def __fingerprint__(self, container: Container) -> str:
+        return cache_key(
+            self.npc,
+            json.dumps(container.session.data, sort_keys=True, default=str),
+            "\n".join(container.instructions),
+            "\n".join(container.facts),
+            "\n".join(container.personality))
+
+    def __lookup__(self, fingerprint: str, embedding: torch.Tensor) -> CachedResponse:
+        bucket = self.buckets.get(fingerprint)
+        if not bucket:
+            return None
+        self.buckets.move_to_end(fingerprint)
+        now = time.monotonic()
+        expired = [entry for entry in bucket if now - entry.created > self.ttl]
+        for entry in expired:
+            bucket.remove(entry)
+            self.size -= 1
+            self.evictions += 1
+        if not bucket:
+            del self.buckets[fingerprint]
+            return None
+        scores = torch.stack([entry.embedding for entry in bucket]) @ embedding
+        best = int(scores.argmax())
+        return bucket[best] if scores[best].item() >= self.threshold else None
+
+    def __store__(self, fingerprint: str, embedding: torch.Tensor, entry: CachedResponse, response: str):
+        with self._lock:
+            if entry != None:
+                if len(entry.responses) < self.variety:
+                    entry.responses.append(response)
+                return
+            self.buckets.setdefault(fingerprint, []).append(CachedResponse(embedding, response))
+            self.buckets.move_to_end(fingerprint)
+            self.size += 1
+            while self.size > self.max_entries:
+                oldest, bucket = next(iter(self.buckets.items()))
+                bucket.pop(0)
+                if not bucket:
+                    del self.buckets[oldest]
+                self.size -= 1
+                self.evictions += 1
+
+    def __resolve__(self, container: Container) -> tuple[str, torch.Tensor, CachedResponse, str]:
+        fingerprint = self.__fingerprint__(container)
+        embedding = F.normalize(
+            container.analysis.embedding(self.embedder, container.input), dim=-1)
+        with self._lock:
+            entry = self.__lookup__(fingerprint, embedding)
+            # Entries that have not collected `variety` responses yet still go to the LLM.
+            if entry != None and len(entry.responses) >= self.variety:
+                self.hits += 1
+                return fingerprint, embedding, entry, random.choice(entry.responses)
+            self.misses += 1
+        return fingerprint, embedding, entry, None
+
+    def generate(self, container: Container) -> str:
+        fingerprint, embedding, entry, response = self.__resolve__(container)
+        if response != None:
+            logger.info(f"Response cache hit: {response}")
+            return response
+        response = self.generation.generate(container)
+        self.__store__(fingerprint, embedding, entry, response)
+        return response
+
+    def generate_stream(self, container: Container) -> Iterator[str]:
+        fingerprint, embedding, entry, response = self.__resolve__(container)
+        if response != None:
+            logger.info(f"Response cache hit: {response}")
+            yield response
+            return
+        chunks = []
+        for chunk in self.generation.generate_stream(container):
+            chunks.append(chunk)
+            yield chunk
+        self.__store__(fingerprint, embedding, entry, "".join(chunks))
@@ -1,16 +1,58 @@
 import logging
+from typing import Iterable, Iterator
 from generation.generation import GenerationModuleBase
 from wrappers import LLMWrapper
 from container import Container
 
 logger = logging.getLogger(__name__)
 
+QUOTES = ('"', "'")
+
+
+def strip_quotes_stream(chunks: Iterable[str]) -> Iterator[str]:
+    # Streaming counterpart of the quote stripping in generate(): an opening quote is
+    # dropped as soon as it arrives and a trailing copy of it is held back until more
+    # text follows, so it is dropped as well if the stream ends on it.
+    quote = None
+    held = ""
+    first = True
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if first:
+            first = False
+            if chunk[0] in QUOTES:
+                quote, chunk = chunk[0], chunk[1:]
+        text, held = held + chunk, ""
+        if quote != None and text.endswith(quote):
+            text, held = text[:-1], quote
+        if text:
+            yield text
+
+
 class SimpleProcessingModule(GenerationModuleBase):
     def __init__(self, llm: LLMWrapper, history_limit: int = 5):
         self.llm = llm
         self.history_limit = history_limit
 
-    def __build_prompt__(self, container: Container) -> str:
+    def __build_prefix__(self, container: Container) -> str:
+        # Only per-NPC content goes here so the prefix stays byte-identical across turns
+        # and backends can reuse its KV cache instead of prefilling it again.
+        personality = ", ".join(container.personality) or "neutral"
+
+        return f"""You are roleplaying a character with the following personality traits: **{personality}**.
+
+Your task:
+- React naturally to the user's input.
+- Follow the intent of the instructions below, but rephrase them in a natural, in-character way.
+- Stay grounded in the provided facts and personality.
+- Do not invent new actions or topics, only reword what's given.
+- Do not add anything new
+- Write small response
+
+"""
+
+    def __build_suffix__(self, container: Container) -> str:
         if container.urgency >= 0.75:
             urgency_desc = "Respond quickly and decisively."
         elif container.urgency >= 0.5:
@@ -18,25 +60,14 @@ class SimpleProcessingModule(GenerationModuleBase):
         else:
             urgency_desc = "Take your time and respond thoughtfully."
 
-        personality = ", ".join(container.personality) or "neutral"
         facts = " ".join(container.facts) or "No specific context."
         instructions = "\n".join(f"- {inst}" for inst in container.instructions) or "- No specific instructions."
 
-        return f"""You are roleplaying a character with the following personality traits: **{personality}**.
-
-Context to consider:
+        return f"""Context to consider:
 - **Known facts**: 
 {facts}
 - **Urgency**: {container.urgency:.2f} → {urgency_desc}
 
-Your task:
-- React naturally to the user's input.
-- Follow the intent of the instructions below, but rephrase them in a natural, in-character way.
-- Stay grounded in the provided facts and personality.
-- Do not invent new actions or topics, only reword what's given.
-- Do not add anything new
-- Write small response
-
 Conversation history:
 {container.history[-self.history_limit:]}
 
@@ -48,10 +79,20 @@ Following intent of instruction below rephrase:
 
 Your short response:"""
 
+    def __build_prompt__(self, container: Container) -> tuple[str, str]:
+        prefix = self.__build_prefix__(container)
+        suffix = self.__build_suffix__(container)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Generated prompt for LLM (prefix {self.llm.prefix_id(prefix)}):\n{prefix}{suffix}")
+        return prefix, suffix
+
     def generate(self,  container: Container) -> str:
-        prompt = self.__build_prompt__(container)
-        logger.info(f"Generated prompt for LLM:\n{prompt}")
-        response = self.llm.generate(prompt)
+        prefix, suffix = self.__build_prompt__(container)
+        response = self.llm.generate_prefixed(prefix, suffix)
         if (response.startswith('"') and response.endswith('"')) or (response.startswith("'") and response.endswith("'")):
             return response[1:-1]
-        return response
\ No newline at end of file
+        return response
+
+    def generate_stream(self, container: Container) -> Iterator[str]:
+        prefix, suffix = self.__build_prompt__(container)
+        yield from strip_quotes_stream(self.llm.generate_prefixed_stream(prefix, suffix))
\ No newline at end of file
@@ -0,0 +1,62 @@
+import logging
+import torch
+import torch.nn.functional as F
+
+logger = logging.getLogger(__name__)
+
+
+class FlatIndex:
+    def __init__(self, vectors: torch.Tensor):
+        self.vectors = F.normalize(vectors, dim=1)
+
+    def search(self, query: torch.Tensor, k: int) -> tuple[list[float], list[int]]:
+        scores = self.vectors @ F.normalize(query, dim=-1).to(self.vectors.device)
+        top = torch.topk(scores, min(k, len(scores)))
+        return top.values.tolist(), top.indices.tolist()
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+
+class IVFIndex:
+    def __init__(self, vectors: torch.Tensor, nlist: int = None, nprobe: int = 8, iterations: int = 10, seed: int = 0):
+        self.vectors = F.normalize(vectors, dim=1)
+        self.nlist = nlist if nlist != None else max(1, int(len(vectors) ** 0.5))
+        self.nprobe = nprobe
+        self.centroids = self.__train__(iterations, seed)
+        assignments = (self.vectors @ self.centroids.T).argmax(dim=1)
+        self.lists: list[torch.Tensor] = [
+            torch.nonzero(assignments == i).flatten() for i in range(self.nlist)]
+        logger.info(f"IVF index: {len(vectors)} vectors in {self.nlist} lists")
+
+    def __train__(self, iterations: int, seed: int) -> torch.Tensor:
+        # Spherical k-means: centroids are kept unit length so assignment is a matmul.
+        generator = torch.Generator().manual_seed(seed)
+        picks = torch.randperm(len(self.vectors), generator=generator)[:self.nlist]
+        centroids = self.vectors[picks.to(self.vectors.device)].clone()
+        for _ in range(iterations):
+            assignments = (self.vectors @ centroids.T).argmax(dim=1)
+            sums = torch.zeros_like(centroids).index_add_(0, assignments, self.vectors)
+            empty = sums.norm(dim=1) == 0
+            sums[empty] = centroids[empty]
+            centroids = F.normalize(sums, dim=1)
+        return centroids
+
+    def search(self, query: torch.Tensor, k: int) -> tuple[list[float], list[int]]:
+        query = F.normalize(query, dim=-1).to(self.vectors.device)
+        probes = torch.topk(self.centroids @ query, min(self.nprobe, self.nlist)).indices
+        candidates = torch.cat([self.lists[i] for i in probes.tolist()])
+        if len(candidates) == 0:
+            return [], []
+        scores = self.vectors[candidates] @ query
+        top = torch.topk(scores, min(k, len(scores)))
+        return top.values.tolist(), candidates[top.indices].tolist()
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+
+def build_index(vectors: torch.Tensor, ivf_threshold: int = 4096, nprobe: int = 8):
+    if len(vectors) < ivf_threshold:
+        return FlatIndex(vectors)
+    return IVFIndex(vectors, nprobe=nprobe)
@@ -2,7 +2,18 @@ import json
 import yaml
 import os
 
+# Configs already parsed into an NPC bundle, keyed by normalized path.
+bundled_configs: dict[str, dict[str, any]] = {}
+
+
+def use_configs(configs: dict[str, dict[str, any]]):
+    bundled_configs.update({os.path.normpath(path): data for path, data in configs.items()})
+
+
 def load_config(file_path) -> dict[str, any]:
+    bundled = bundled_configs.get(os.path.normpath(file_path))
+    if bundled != None:
+        return bundled
     if not os.path.isfile(file_path):
         raise FileNotFoundError(f"The file '{file_path}' does not exist.")
     _, ext = os.path.splitext(file_path)
@@ -12,7 +23,7 @@ def load_config(file_path) -> dict[str, any]:
             match ext:
                 case ".json":
                     return json.load(file)
-                case '.yml', '.yaml':
+                case '.yml' | '.yaml':
                     return yaml.safe_load(file)
                 case _:
                     raise ValueError(f"Unsupported file extension: {ext}")
@@ -1,5 +1,8 @@
 import tkinter as tk
+import functools
 import logging
+import os
+import sys
 import spacy
 import torch
 from sentence_transformers import SentenceTransformer
@@ -7,55 +10,131 @@ from chat import ChatApp
 from preprocessing.impl.simplePreprocessor import SimplePreprocessor
 from langchain_ollama.llms import OllamaLLM
 from flow.impl.fsmDialogueFlowModule import FSMDialogueFlowModule
-from wrappers import SummarizationWrapper, EmbedderWrapper, SentimentWrapper, ExtractionWrapper, LLMWrapper, ParaphraserWrapper
+from wrappers import SummarizationWrapper, CachedEmbedderWrapper, BatchingEmbedderWrapper, BatchingSentimentWrapper, BatchingExtractionWrapper, LLMWrapper, CachedParaphraserWrapper
+from cache import EmbeddingCache, JsonCache
 from personality.impl.simplePersonalityModule import SimplePersonalityModule
 from memory.impl.knowledgeGrpaphMemoryModule import KnowledgeGrpaphMemoryModule
 from generation.impl.simpleProcessingModule import SimpleProcessingModule
 from pipeline import DialoguePipline
+from session import SessionStore
 from transformers import pipeline
 from facts import FactSystem
-from events import EventSystem
+from events import EventSystem, MODE_SYNC
+from tracing import tracer
+from models import ModelLoader
+from condition import default_registry
+from bundle import NPCBundle, BundleError, compile_bundle
+from serving import ServingPool
 logger = logging.getLogger(__name__)
 
-def config():
+CACHE_DIR = ".cache"
+TRACE_FILE = os.environ.get("DIALOGUE_TRACE")
+BUNDLE_FILE = os.environ.get("DIALOGUE_BUNDLE", f"{CACHE_DIR}/npc.bundle")
+# With more than one worker, turns are served by a pool of processes that each
+# build their own pipeline and own the sessions hashed to them.
+WORKERS = int(os.environ.get("DIALOGUE_WORKERS", "1"))
+SESSION_DIR = f"{CACHE_DIR}/sessions"
+EVENTS_MODE = os.environ.get("DIALOGUE_EVENTS", MODE_SYNC)
+SESSION_MAX_IDLE = 15 * 60
+EMBEDDER_ID = "stsb-roberta-large"
+FLOW_CONFIG = "example_configs/fsm_dialogue.json"
+PERSONALITY_CONFIG = "example_configs/rule_personality.json"
+WORLD_CONFIG = "example_configs/graph_world_state.json"
+
+
+class RuntimeModels:
+    # Models are built on first use; the ones the chosen modules and compiled
+    # conditions need are loaded in parallel by config(), the rest never are.
+    def __init__(self):
+        device = "cuda:0" if torch.cuda.is_available() else "cpu"
+        self.loader = ModelLoader()
+        summarizer = self.loader.lazy("summarizer", lambda: pipeline(
+            "summarization", model="facebook/bart-large-cnn", device=device))
+        embedder = self.loader.lazy("embedder", lambda: SentenceTransformer(EMBEDDER_ID, device=device))
+        sentiment = self.loader.lazy("sentiment", lambda: pipeline(
+            "sentiment-analysis", model="finiteautomata/bertweet-base-sentiment-analysis", device=device))
+        nlp = self.loader.lazy("ner", lambda: spacy.load("en_core_web_sm"))
+        self.summarizer = SummarizationWrapper(lambda txt, min, max: summarizer.get()(
+            txt, min_length=min, max_length=max, do_sample=False)[0]['summary_text'])
+        batchEmbedderWrapper = BatchingEmbedderWrapper(
+            lambda args: list(embedder.get().encode(args, convert_to_tensor=True)))
+        self.embedder = CachedEmbedderWrapper(
+            batchEmbedderWrapper.encode,
+            EMBEDDER_ID, EmbeddingCache(f"{CACHE_DIR}/embeddings"), device)
+        self.sentiment = BatchingSentimentWrapper(lambda args: sentiment.get()(args))
+        self.extractor = BatchingExtractionWrapper(
+            lambda txts: [[ent.text for ent in doc.ents] for doc in nlp.get().pipe(txts)])
+        llm = OllamaLLM(model="llama3")
+        self.paraphraser = CachedParaphraserWrapper(lambda n, t: llm.invoke(
+            (
+                f"Give me {n} different natural sentences to say: '{t}'.\n"
+                "List them, one per line. Do not write anything else"
+            )
+        )[0]['generated_text'].split("\n"), "llama3", JsonCache(f"{CACHE_DIR}/paraphrases.jsonl"))
+        self.llm = LLMWrapper(lambda prompt: llm.invoke(prompt),
+                              lambda prompt: llm.stream(prompt))
+
+
+# One set per process: a pipeline rebuilt for a new bundle reuses the loaded models.
+runtime_models: RuntimeModels = None
+
+
+def config(compile_only: bool = False, compile: bool = True):
+    global runtime_models
     logger.info("Initializing...")
+    # Conditions interned by an earlier build hold on to its wrappers and facts.
+    default_registry.clear()
+    if runtime_models == None:
+        runtime_models = RuntimeModels()
+    models = runtime_models
+    loader = models.loader
 
-    device = "cuda:0" if torch.cuda.is_available() else "cpu"
-    summarizer = pipeline(
-        "summarization", model="facebook/bart-large-cnn", device=device)
-    summarizerWrapper = SummarizationWrapper(lambda txt, min, max: summarizer(
-        txt, min_length=min, max_length=max, do_sample=False)[0]['summary_text'])
-    embedder = SentenceTransformer("stsb-roberta-large", device=device)
-    embedderWrapper = EmbedderWrapper(
-        lambda arg: embedder.encode(arg, convert_to_tensor=True))
-    sentiment = pipeline(
-        "sentiment-analysis", model="finiteautomata/bertweet-base-sentiment-analysis", device=device)
-    sentimentWrapper = SentimentWrapper(lambda arg: sentiment(arg)[0])
-    nlp = spacy.load("en_core_web_sm")
-    extrWrapper = ExtractionWrapper(
-        lambda txt: [ent.text for ent in nlp(txt).ents])
-    llm = OllamaLLM(model="llama3")
-    paraphraserWrapper = ParaphraserWrapper(lambda n, t: llm.invoke(
-        (
-            f"Give me {n} different natural sentences to say: '{t}'.\n"
-            "List them, one per line. Do not write anything else"
-        )
-    )[0]['generated_text'].split("\n"))
-    llmWrapper = LLMWrapper(lambda prompt: llm.invoke(prompt))
-
-    events = EventSystem()
+    # Configs and compiled conditions come from the bundle, which is rebuilt
+    # whenever a source config or the embedding model changes. Pool workers only
+    # load it, so processes sharing the caches never compile at the same time.
+    sources = [FLOW_CONFIG, PERSONALITY_CONFIG, WORLD_CONFIG]
+    try:
+        npc = NPCBundle.load(BUNDLE_FILE, sources, EMBEDDER_ID)
+    except BundleError as e:
+        if not compile:
+            raise
+        logger.info(f"Compiling NPC bundle: {e}")
+        compile_bundle(sources, BUNDLE_FILE, models.embedder, models.paraphraser, EMBEDDER_ID)
+        npc = NPCBundle.load(BUNDLE_FILE)
+    if compile_only:
+        return None
+    npc.install()
+
+    # Handlers run before generation continues unless DIALOGUE_EVENTS=async; then
+    # only those registered with sync=True do.
+    events = EventSystem(mode=EVENTS_MODE)
     facts = FactSystem()
 
-    preprocessor = SimplePreprocessor(summarizerWrapper)
+    # The summarizer stays lazy: only inputs longer than max_input_len need it.
+    preprocessor = SimplePreprocessor(models.summarizer)
+    memoryModule = KnowledgeGrpaphMemoryModule(
+        WORLD_CONFIG, models.extractor, facts)
+    if memoryModule.ner_fallback:
+        loader.preload("ner")
+    # Compiling conditions only needs the embedder for embeddings missing from the cache.
     flowModule = FSMDialogueFlowModule(
-        "example_configs/fsm_dialogue.json", embedderWrapper, sentimentWrapper, paraphraserWrapper, facts, events)
+        FLOW_CONFIG, models.embedder, models.sentiment, models.paraphraser, facts, events)
     personalityModule = SimplePersonalityModule(
-        "example_configs/rule_personality.json", embedderWrapper, sentimentWrapper, paraphraserWrapper, facts, events)
-    memoryModule = KnowledgeGrpaphMemoryModule(
-        "example_configs/graph_world_state.json", extrWrapper, facts)
-    processingModule = SimpleProcessingModule(llmWrapper)
+        PERSONALITY_CONFIG, models.embedder, models.sentiment, models.paraphraser, facts, events)
+    usage = default_registry.usage()
+    logger.info(f"Condition leaves by kind: {usage}")
+    if usage.get("sim"):
+        loader.preload("embedder")
+    if usage.get("sent"):
+        loader.preload("sentiment")
+    processingModule = SimpleProcessingModule(models.llm)
+    # Every session gets its own copy of the NPC's facts; idle ones are spilled to disk.
+    sessions = SessionStore(spill_dir=SESSION_DIR, facts_factory=facts.fork)
     dialogue_pipeline = DialoguePipline(
-        preprocessor, flowModule, personalityModule, memoryModule, processingModule)
+        preprocessor, flowModule, personalityModule, memoryModule, processingModule,
+        sessions=sessions, events=events, max_idle=SESSION_MAX_IDLE)
+    loader.wait()
+    loader.report()
     logger.info("Initialization is finished")
     return dialogue_pipeline
 
@@ -63,8 +142,18 @@ def config():
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)  # ERROR
     use_gui = True
+    if sys.argv[1:] == ["compile"]:
+        config(compile_only=True)
+        sys.exit(0)
+    if TRACE_FILE:
+        tracer.enable()
 
-    dialogue_pipeline = config()
+    if WORKERS > 1:
+        config(compile_only=True)
+        dialogue_pipeline = ServingPool(functools.partial(config, compile=False), WORKERS,
+                                        spill_dir=SESSION_DIR, log_level=logging.INFO)
+    else:
+        dialogue_pipeline = config()
 
     if use_gui:
         root = tk.Tk()
@@ -76,8 +165,16 @@ if __name__ == "__main__":
                 user_input = input("\nYou: ")
                 if user_input.lower() == 'exit':
                     break
-                print(dialogue_pipeline.evaluate(user_input))
+                for chunk in dialogue_pipeline.evaluate_stream(user_input):
+                    print(chunk, end="", flush=True)
+                print()
 
             except KeyboardInterrupt:
                 print('Interrupted')
                 break
+
+    if WORKERS > 1:
+        dialogue_pipeline.close()
+    if TRACE_FILE:
+        tracer.export_chrome(TRACE_FILE)
+        tracer.export_summary(f"{TRACE_FILE}.summary.json")
@@ -0,0 +1,92 @@
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class Gazetteer:
+    def __init__(self, data: dict[str, dict[str, any]]):
+        self.patterns: list[str] = []
+        self.records: dict[str, list[tuple[str, str]]] = {}
+        for section, entries in data.items():
+            if not isinstance(entries, dict):
+                continue
+            for name, record in entries.items():
+                aliases = record.get("aliases", []) if isinstance(record, dict) else []
+                for alias in [name, *aliases]:
+                    self.__add__(alias, section, name)
+        self.__build__()
+        logger.info(f"Gazetteer: {len(self.patterns)} names and aliases")
+
+    def __add__(self, alias: str, section: str, name: str):
+        key = alias.strip().lower()
+        if not key:
+            return
+        if key not in self.records:
+            self.records[key] = []
+            self.patterns.append(key)
+        if (section, name) not in self.records[key]:
+            self.records[key].append((section, name))
+
+    def __build__(self):
+        # Aho-Corasick automaton over the lowercased names: goto transitions, failure
+        # links and, per state, the patterns that end there.
+        self.goto: list[dict[str, int]] = [{}]
+        self.fail: list[int] = [0]
+        self.output: list[list[int]] = [[]]
+        for pid, pattern in enumerate(self.patterns):
+            state = 0
+            for char in pattern:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.output[state].append(pid)
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                if self.output[self.fail[child]]:
+                    self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def lookup(self, name: str) -> list[tuple[str, str]]:
+        return self.records.get(name.strip().lower(), [])
+
+    def find(self, text: str) -> list[tuple[str, str]]:
+        lowered = text.lower()
+        matches = []
+        state = 0
+        for end, char in enumerate(lowered, 1):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for pid in self.output[state]:
+                start = end - len(self.patterns[pid])
+                if self.__bounded__(lowered, start, end):
+                    matches.append((start, end, pid))
+        # Keep the leftmost-longest matches so "Trollbrew Ale" wins over an alias "Trollbrew".
+        matches.sort(key=lambda m: (m[0], m[0] - m[1]))
+        found = []
+        covered = 0
+        for start, end, pid in matches:
+            if start >= covered:
+                covered = end
+                for record in self.records[self.patterns[pid]]:
+                    if record not in found:
+                        found.append(record)
+        return found
+
+    def __bounded__(self, text: str, start: int, end: int) -> bool:
+        before = text[start - 1] if start > 0 else " "
+        after = text[end] if end < len(text) else " "
+        return not before.isalnum() and not after.isalnum()
+
+    def __len__(self) -> int:
+        return len(self.patterns)
@@ -0,0 +1,97 @@
+import logging
+import re
+from collections import deque
+from memory.impl.gazetteer import Gazetteer
+
+logger = logging.getLogger(__name__)
+
+Node = tuple[str, str]
+
+
+class KnowledgeGraph:
+    def __init__(self, data: dict[str, dict[str, any]], gazetteer: Gazetteer):
+        self.data = data
+        self.adjacency: dict[Node, dict[str, list[Node]]] = {}
+        edges = 0
+        for section, entries in data.items():
+            if not isinstance(entries, dict):
+                continue
+            for name, record in entries.items():
+                if not isinstance(record, dict):
+                    continue
+                for relation, value in record.items():
+                    values = value if isinstance(value, list) else [value]
+                    for target in values:
+                        if not isinstance(target, str):
+                            continue
+                        for node in gazetteer.lookup(target):
+                            if node != (section, name):
+                                self.__link__((section, name), relation, node)
+                                self.__link__(node, f"~{relation}", (section, name))
+                                edges += 1
+        logger.info(f"Knowledge graph: {len(self.adjacency)} linked entities, {edges} relations")
+
+    def __link__(self, source: Node, relation: str, target: Node):
+        targets = self.adjacency.setdefault(source, {}).setdefault(relation, [])
+        if target not in targets:
+            targets.append(target)
+
+    def neighbours(self, node: Node, relation: str = None) -> list[Node]:
+        relations = self.adjacency.get(node, {})
+        if relation != None:
+            return relations.get(relation, [])
+        return [target for targets in relations.values() for target in targets]
+
+    def expand(self, seeds: list[Node], hops: int) -> dict[Node, int]:
+        distances = {seed: 0 for seed in seeds}
+        queue = deque(seeds)
+        while queue:
+            node = queue.popleft()
+            if distances[node] >= hops:
+                continue
+            for target in self.neighbours(node):
+                if target not in distances:
+                    distances[target] = distances[node] + 1
+                    queue.append(target)
+        return distances
+
+    def render(self, node: Node) -> str:
+        return f"{node[1]}: {self.data[node[0]][node[1]]}"
+
+    def retrieve(self, seeds: list[Node], text: str, hops: int = 1, max_facts: int = 8, max_tokens: int = 256) -> list[str]:
+        # Facts are ranked by hop distance, boosted by word overlap with the input, and
+        # added until either the fact count or the approximate token budget runs out.
+        words = set(re.findall(r"\w+", text.lower()))
+        scored = []
+        for node, hop in self.expand(seeds, hops).items():
+            fact = self.render(node)
+            fact_words = set(re.findall(r"\w+", fact.lower()))
+            overlap = len(words & fact_words) / len(fact_words) if fact_words else 0
+            scored.append(((1 + overlap) / (1 + hop), hop, fact))
+        scored.sort(key=lambda s: s[0], reverse=True)
+        facts = []
+        dropped = []
+        tokens = 0
+        pending = sum(1 for _, hop, _ in scored if hop == 0)
+        for _, hop, fact in scored:
+            if len(facts) >= max_facts:
+                break
+            words = fact.split()
+            if hop == 0:
+                # Entities the player named are cut to their share of the remaining
+                # budget rather than left out of the prompt.
+                share = (max_tokens - tokens) // pending
+                pending -= 1
+                if share > 0 and len(words) > share:
+                    logger.info(f"Truncated fact to {share} of {len(words)} words: {fact[:80]}")
+                    words = words[:share]
+                    fact = " ".join(words) + "..."
+            if tokens + len(words) > max_tokens:
+                dropped.append(fact)
+                continue
+            facts.append(fact)
+            tokens += len(words)
+        if dropped:
+            logger.info(f"Dropped {len(dropped)} facts over the {max_tokens} token budget: "
+                        f"{[fact[:40] for fact in dropped]}")
+        return facts
@@ -1,38 +1,59 @@
 import logging
-import json
-import re
 from facts import FactSystem
+from templates import compile_template
 import loader
 from container import Container
 from memory.memory import MemoryModuleBase
+from memory.impl.gazetteer import Gazetteer
+from memory.impl.knowledgeGraph import KnowledgeGraph
 from wrappers import ExtractionWrapper
 logger = logging.getLogger(__name__)
 
 
 class KnowledgeGrpaphMemoryModule(MemoryModuleBase):
-    def __init__(self, file_path: str, extr: ExtractionWrapper, facts: FactSystem):
+    def __init__(self, file_path: str, extr: ExtractionWrapper, facts: FactSystem, ner_fallback: bool = True, max_templates: int = 4096, hops: int = 1, max_facts: int = 8, max_tokens: int = 256):
         self.extr = extr
         self.data = loader.load_config(file_path)
         self.facts: FactSystem = facts
+        self.gazetteer = Gazetteer(self.data)
+        self.graph = KnowledgeGraph(self.data, self.gazetteer)
+        self.hops = hops
+        self.max_facts = max_facts
+        self.max_tokens = max_tokens
+        self.ner_fallback = ner_fallback
+        self.max_templates = max_templates
+        self.template_entities: dict[str, list[tuple[str, str]]] = {}
+
+    def __entities__(self, text: str, container: Container) -> list[tuple[str, str]]:
+        entities = self.gazetteer.find(text)
+        if not entities and self.ner_fallback:
+            for entity in container.analysis.entities(self.extr, text):
+                entities += [e for e in self.gazetteer.lookup(entity) if e not in entities]
+        return entities
+
+    def __template_entities__(self, template: str, container: Container) -> list[tuple[str, str]]:
+        # Instruction templates come from static configs, so their entities are found once.
+        entities = self.template_entities.get(template)
+        if entities == None:
+            if len(self.template_entities) >= self.max_templates:
+                self.template_entities.clear()
+            entities = self.__entities__(template, container)
+            self.template_entities[template] = entities
+        return entities
 
     def __populate_facts__(self, container: Container):
-        for t in [container.input, *container.instructions]:
-            for entity in self.extr.extract_entities(t):
-                for name, dict in self.data.items():
-                    fact = dict.get(entity)
-                    if fact != None:
-                        container.facts.append(str(fact))
+        entities = self.__entities__(container.input, container)
+        for template in container.instructions:
+            entities += self.__template_entities__(template, container)
+        facts = self.graph.retrieve(list(dict.fromkeys(entities)), container.input,
+                                    self.hops, self.max_facts, self.max_tokens)
+        logger.info(f"Retrieved {len(facts)} facts for {len(entities)} entities")
+        container.facts += facts
 
     def __insert_facts__(self, container: Container):
-        pattern = re.compile(r'\$\{(.*?)\}')
+        facts = container.fact_system(self.facts)
         for i in range(len(container.instructions)):
-            container.instructions[i] = pattern.sub(
-                lambda match: self.__replace_fact__(match), container.instructions[i])
-
-    def __replace_fact__(self, match) -> str:
-        fact_name = match.group(1)
-        fact = self.facts.get_fact(fact_name).get()
-        return str(fact) if fact else ""
+            container.instructions[i] = compile_template(container.instructions[i]).render(facts)
 
     def process(self, container: Container):
         self.__populate_facts__(container)
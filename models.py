@@ -0,0 +1,83 @@
+import logging
+import os
+import resource
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class LazyModel:
+    # Builds the model on first get(); concurrent callers wait for the same load.
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        self.name = name
+        self.factory = factory
+        self.model = None
+        self.loaded = False
+        self.load_seconds = 0.0
+        self.rss_mb = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> Any:
+        if self.loaded:
+            return self.model
+        with self._lock:
+            if not self.loaded:
+                logger.info(f"Loading model '{self.name}'...")
+                before = rss_mb()
+                start = time.perf_counter()
+                self.model = self.factory()
+                self.load_seconds = time.perf_counter() - start
+                self.rss_mb = rss_mb() - before
+                self.loaded = True
+                logger.info(f"Loaded model '{self.name}' in {self.load_seconds:.2f}s (+{self.rss_mb:.0f} MB RSS)")
+        return self.model
+
+
+class ModelLoader:
+    def __init__(self, workers: int = 4):
+        self.models: dict[str, LazyModel] = {}
+        self.futures: dict[str, Future] = {}
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="model-loader")
+
+    def lazy(self, name: str, factory: Callable[[], Any]) -> LazyModel:
+        model = LazyModel(name, factory)
+        self.models[name] = model
+        return model
+
+    def preload(self, *names: str):
+        # Starts loading in the background; a first use before it finishes just waits.
+        for name in names:
+            if name not in self.futures:
+                self.futures[name] = self._executor.submit(self.models[name].get)
+
+    def wait(self):
+        for name, future in self.futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Failed to load model '{name}': {e}")
+
+    def report(self) -> dict[str, dict[str, Any]]:
+        # RSS deltas overlap when models load concurrently, so they are approximate.
+        report = {}
+        for name, model in self.models.items():
+            report[name] = {"loaded": model.loaded, "load_seconds": model.load_seconds, "rss_mb": model.rss_mb}
+            if model.loaded:
+                logger.info(f"Model '{name}': {model.load_seconds:.2f}s, +{model.rss_mb:.0f} MB RSS")
+            else:
+                logger.info(f"Model '{name}': not loaded")
+        return report
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
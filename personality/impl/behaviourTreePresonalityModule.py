@@ -6,6 +6,7 @@ from personality.personality import PersonalityModuleBase
 from container import Container
 from abc import ABC, abstractmethod
 from condition import Condition
+from templates import compile_template
 import loader
 
 logger = logging.getLogger(__name__)
@@ -59,18 +60,19 @@ class ConditionNode(BTNode):
         self.condition = condition
 
     def run(self, container) -> bool:
-        return self.condition.eval(container.input)
+        return self.condition.eval(container.input, container.analysis)
 
 
 class ActionNode(BTNode):
     def __init__(self, template: str, callback: str, mode: str, events):
         self.template = template
+        compile_template(template)
         self.callback = callback
         self.mode = mode
         self.events = events
 
     def run(self, container) -> bool:
-        self.events.invoke(self.callback)
+        self.events.invoke(self.callback, container.session.id)
         if self.mode == "overwrite":
             container.instructions = [self.template]
         else:
@@ -5,24 +5,66 @@ from wrappers import EmbedderWrapper, SentimentWrapper, ParaphraserWrapper
 from personality.personality import PersonalityModuleBase
 from container import Container
 from personality.rule import Rule
+from index import build_index
+import torch
 import loader
 
 logger = logging.getLogger(__name__)
 
 
 class SimplePersonalityModule(PersonalityModuleBase):
-    def __init__(self, config_file: str, embedder: EmbedderWrapper, sentiment: SentimentWrapper, paraphraser: ParaphraserWrapper, facts: FactSystem, events: EventSystem, paraphrasings: int = 0, default_threshold: float = 0.8):
+    def __init__(self, config_file: str, embedder: EmbedderWrapper, sentiment: SentimentWrapper, paraphraser: ParaphraserWrapper, facts: FactSystem, events: EventSystem, paraphrasings: int = 0, default_threshold: float = 0.8, candidate_k: int = 0, oversample: int = 4):
         conf = loader.load_config(config_file)
         self.default_threshold = default_threshold
         self.description = conf.get("description", "")
         self.rules: list[Rule] = Rule.parse_rules(
             conf.get("rules", []), embedder, sentiment, paraphraser, facts, paraphrasings)
         self.events = events
+        self.embedder = embedder
+        self.candidate_k = candidate_k
+        self.oversample = oversample
+        self.index = None
+        if candidate_k > 0:
+            self.__build_index__()
+
+    def __build_index__(self):
+        # Rules are only skipped when a sim() leaf caps their value, i.e. the condition
+        # is a bare sim() or an `and` with one; they are evaluated when one of those
+        # anchors is among the nearest to the input. Every other rule is always evaluated.
+        anchors = []
+        self.anchor_rules: list[int] = []
+        self.unindexed: set[int] = set()
+        for i, rule in enumerate(self.rules):
+            evaluators = rule.condition.gating_similarity_evaluators()
+            if not evaluators:
+                self.unindexed.add(i)
+            for ev in evaluators:
+                anchors.append(ev.arg_embeddings)
+                self.anchor_rules += [i] * len(ev.arg_embeddings)
+        if anchors:
+            self.index = build_index(torch.cat(anchors))
+            logger.info(f"Indexed {len(self.index)} anchors of {len(self.rules) - len(self.unindexed)} rules")
+
+    def __candidates__(self, container: Container) -> list[Rule]:
+        if self.index == None:
+            return self.rules
+        query = container.analysis.embedding(self.embedder, container.input)
+        _, rows = self.index.search(query, self.candidate_k * self.oversample)
+        selected = set(self.unindexed)
+        found = 0
+        for row in rows:
+            rule = self.anchor_rules[row]
+            if rule not in selected:
+                selected.add(rule)
+                found += 1
+                if found >= self.candidate_k:
+                    break
+        return [self.rules[i] for i in sorted(selected)]
 
     def __apply_rules__(self, container: Container):
-        for rule in self.rules:
+        for rule in self.__candidates__(container):
             if rule.freedom >= container.freedom:
-                val = rule.condition.eval(container.input) 
+                val = rule.condition.eval(container.input, container.analysis)
                 logger.info(val)
                 if val >= self.default_threshold:
                     if rule.type == "overwrite":
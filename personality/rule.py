@@ -1,6 +1,7 @@
 import json
 from dataclasses import dataclass
 from condition import Condition
+from templates import compile_template
 from events import EventSystem
 from facts import FactSystem
 from wrappers import EmbedderWrapper, ParaphraserWrapper, SentimentWrapper
@@ -15,6 +16,9 @@ class Rule:
     type: str = "insert"
     callback: str = ""
 
+    def __post_init__(self):
+        compile_template(self.template)
+
     @staticmethod
     def parse_rules(data: dict[str, any], embedder: EmbedderWrapper, sentiment: SentimentWrapper, paraphraser: ParaphraserWrapper, facts: FactSystem, events: EventSystem, paraphrasings: int = 0) -> list:
         rules = []
@@ -5,26 +5,75 @@ from flow.dialogue import DialogueFlowModuleBase
 from personality.personality import PersonalityModuleBase
 from generation.generation import GenerationModuleBase
 import logging
+import time
+from typing import Iterator
 from container import Container
+from analysis import TurnAnalysis
+from session import SessionStore, DEFAULT_SESSION
+from events import EventSystem
+from tracing import tracer
 logger = logging.getLogger(__name__)
 
 
 class DialoguePipline:
-    def __init__(self, preprocessor: PreprocessorBase, dialogue: DialogueFlowModuleBase, personality: PersonalityModuleBase, memory: MemoryModuleBase, processing: GenerationModuleBase):
+    def __init__(self, preprocessor: PreprocessorBase, dialogue: DialogueFlowModuleBase, personality: PersonalityModuleBase, memory: MemoryModuleBase, processing: GenerationModuleBase, sessions: SessionStore = None, events: EventSystem = None, max_idle: float = None):
         self.preprocessor: PreprocessorBase = preprocessor
         self.dialogue: DialogueFlowModuleBase = dialogue
         self.personality: PersonalityModuleBase = personality
         self.processing: GenerationModuleBase = processing
         self.memory: MemoryModuleBase = memory
-        self.history: list[str] = []
-
-    def evaluate(self, input: str) -> str:
-        container = Container(input=input, history=self.history)
-        self.preprocessor.process(container)
-        self.dialogue.process(container)
-        self.personality.process(container)
-        self.memory.process(container)
-        output = self.processing.generate(container)
-        self.history.append(container.input)
-        self.history.append(output)
+        self.sessions: SessionStore = sessions if sessions != None else SessionStore()
+        self.events: EventSystem = events
+        # Sessions unused for `max_idle` seconds are spilled, checked between turns.
+        self.max_idle = max_idle
+        self._last_sweep = time.monotonic()
+
+    @property
+    def history(self) -> list[str]:
+        return self.sessions.get(DEFAULT_SESSION).history
+
+    def __prepare__(self, input: str, session) -> Container:
+        container = Container(input=input, history=session.history,
+                              analysis=TurnAnalysis(session.facts), session=session)
+        for stage, module in (("preprocess", self.preprocessor), ("dialogue", self.dialogue),
+                              ("personality", self.personality), ("memory", self.memory)):
+            with tracer.span(stage, module=type(module).__name__):
+                module.process(container)
+        return container
+
+    def evaluate(self, input: str, session_id: str = DEFAULT_SESSION) -> str:
+        with self.sessions.use(session_id) as session, session.lock, \
+                tracer.span("turn", chars=len(input), session=session_id):
+            container = self.__prepare__(input, session)
+            with tracer.span("generate", module=type(self.processing).__name__):
+                output = self.processing.generate(container)
+            session.history.append(container.input)
+            session.history.append(output)
+        self.__end_turn__(session_id)
+        logger.info(f"Turn stats: {container.analysis.stats}")
         return output
+
+    def evaluate_stream(self, input: str, session_id: str = DEFAULT_SESSION) -> Iterator[str]:
+        with self.sessions.use(session_id) as session, session.lock, \
+                tracer.span("turn", chars=len(input), session=session_id):
+            container = self.__prepare__(input, session)
+            chunks = []
+            # A consumer that stops early still gets the turn recorded, with the part
+            # of the reply it was given, since the other stages already ran.
+            try:
+                with tracer.span("generate", module=type(self.processing).__name__):
+                    for chunk in self.processing.generate_stream(container):
+                        chunks.append(chunk)
+                        yield chunk
+            finally:
+                session.history.append(container.input)
+                session.history.append("".join(chunks))
+        self.__end_turn__(session_id)
+        logger.info(f"Turn stats: {container.analysis.stats}")
+
+    def __end_turn__(self, session_id: str):
+        if self.events != None:
+            self.events.end_turn(session_id)
+        if self.max_idle != None and time.monotonic() - self._last_sweep > self.max_idle / 4:
+            self._last_sweep = time.monotonic()
+            self.sessions.spill_idle(self.max_idle)
@@ -0,0 +1,496 @@
+# Network entry point for game servers, on asyncio streams only:
+#   python server.py --stub --port 8080            stub models, no downloads or LLM server
+#   python server.py --workers 4                   real models, one pipeline per worker process
+# POST /npcs/<npc>/sessions/<session>/turns {"input": "...", "stream": false}
+# GET  /npcs/<npc>/sessions/<session>/ws    WebSocket, one JSON {"input": "..."} message per turn
+# GET  /health, GET /metrics
+import argparse
+import asyncio
+import base64
+import contextlib
+import functools
+import hashlib
+import json
+import logging
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator
+from urllib.parse import unquote, urlsplit
+from serving import ServingPool
+from tracing import Histogram
+
+logger = logging.getLogger(__name__)
+
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+IDLE_TIMEOUT = 60
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OPCODE_CONTINUATION = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+STATUS_TEXT = {
+    101: "Switching Protocols", 200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    413: "Payload Too Large", 431: "Request Header Fields Too Large", 500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class Request:
+    def __init__(self, method: str, target: str, version: str, headers: dict[str, str], body: bytes):
+        self.method = method
+        self.path = [unquote(part) for part in urlsplit(target).path.split("/") if part]
+        self.version = version
+        self.headers = headers
+        self.body = body
+
+    @property
+    def keep_alive(self) -> bool:
+        connection = self.headers.get("connection", "").lower()
+        return connection != "close" if self.version == "HTTP/1.1" else connection == "keep-alive"
+
+    def json(self) -> dict:
+        try:
+            data = json.loads(self.body or b"{}")
+        except (ValueError, UnicodeDecodeError) as e:
+            raise HttpError(400, f"Invalid JSON body: {e}")
+        if not isinstance(data, dict):
+            raise HttpError(400, "Body must be a JSON object")
+        return data
+
+
+class SessionSlot:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+class DialogueServer:
+    def __init__(self, npcs: dict[str, any], host: str = "127.0.0.1", port: int = 8080,
+                 max_concurrency: int = 8, max_queue: int = 64):
+        # `npcs` maps NPC names to a DialoguePipline or a ServingPool. At most
+        # `max_concurrency` turns run at once, each on an executor thread; turns of one
+        # session wait for each other in arrival order, and once `max_queue` turns are
+        # waiting new ones are refused with 503 rather than queued.
+        self.npcs = npcs
+        self.host = host
+        self.port = port
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_concurrency, thread_name_prefix="dialogue-turn")
+        self.inflight = 0
+        self.queued = 0
+        self.counters = {"requests": 0, "turns": 0, "shed": 0, "errors": 0, "websockets": 0}
+        self.latency = {"turn": Histogram(), "queue_wait": Histogram(), "first_chunk": Histogram()}
+        self.started = time.monotonic()
+        self.server: asyncio.Server = None
+        self._slots: asyncio.Semaphore = None
+        self._sessions: dict[tuple[str, str], SessionSlot] = {}
+
+    async def start(self):
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self.server = await asyncio.start_server(self.__connection__, self.host, self.port, limit=MAX_HEADER_BYTES)
+        logger.info(f"Serving {', '.join(self.npcs)} on {self.host}:{self.port}")
+
+    async def serve_forever(self):
+        if self.server == None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        if self.server != None:
+            self.server.close()
+            await self.server.wait_closed()
+        self.executor.shutdown(wait=True)
+
+    def metrics(self) -> dict[str, any]:
+        return {
+            "uptime_s": time.monotonic() - self.started,
+            "inflight": self.inflight,
+            "queued": self.queued,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "counters": dict(self.counters),
+            "latency": {name: histogram.to_dict() for name, histogram in self.latency.items()},
+        }
+
+    @contextlib.asynccontextmanager
+    async def __admit__(self, npc: str, session_id: str):
+        if self.queued >= self.max_queue:
+            self.counters["shed"] += 1
+            raise HttpError(503, f"Server is overloaded: {self.queued} turns waiting")
+        key = (npc, session_id)
+        slot = self._sessions.get(key)
+        if slot == None:
+            slot = self._sessions[key] = SessionSlot()
+        slot.users += 1
+        self.queued += 1
+        start = time.perf_counter()
+        admitted = False
+        try:
+            await slot.lock.acquire()
+            try:
+                await self._slots.acquire()
+            except BaseException:
+                slot.lock.release()
+                raise
+            admitted = True
+        finally:
+            self.queued -= 1
+            if not admitted:
+                self.__leave__(key, slot)
+        self.latency["queue_wait"].record((time.perf_counter() - start) * 1000)
+        self.inflight += 1
+        try:
+            yield
+        finally:
+            self.inflight -= 1
+            self._slots.release()
+            slot.lock.release()
+            self.__leave__(key, slot)
+
+    def __leave__(self, key: tuple[str, str], slot: SessionSlot):
+        slot.users -= 1
+        if slot.users == 0:
+            del self._sessions[key]
+
+    def __pipeline__(self, npc: str):
+        pipeline = self.npcs.get(npc)
+        if pipeline == None:
+            raise HttpError(404, f"Unknown NPC '{npc}'")
+        return pipeline
+
+    async def __turn__(self, npc: str, session_id: str, text: str) -> AsyncIterator[str]:
+        # Runs one turn under admission control and yields its chunks. The turn always
+        # runs to completion, even if the caller stops reading, so session state stays
+        # consistent; chunks nobody reads are dropped.
+        pipeline = self.__pipeline__(npc)
+        loop = asyncio.get_running_loop()
+        async with self.__admit__(npc, session_id):
+            start = time.perf_counter()
+            chunks: asyncio.Queue = asyncio.Queue()
+
+            def produce():
+                try:
+                    for chunk in pipeline.evaluate_stream(text, session_id):
+                        loop.call_soon_threadsafe(chunks.put_nowait, (chunk, None))
+                except Exception as e:
+                    loop.call_soon_threadsafe(chunks.put_nowait, (None, e))
+                else:
+                    loop.call_soon_threadsafe(chunks.put_nowait, (None, None))
+
+            done = loop.run_in_executor(self.executor, produce)
+            first = True
+            reading = True
+            failed = False
+            try:
+                while True:
+                    chunk, error = await chunks.get()
+                    if error != None:
+                        failed = True
+                        self.counters["errors"] += 1
+                        raise error
+                    if chunk == None:
+                        break
+                    if first:
+                        self.latency["first_chunk"].record((time.perf_counter() - start) * 1000)
+                        first = False
+                    if reading:
+                        try:
+                            yield chunk
+                        except GeneratorExit:
+                            reading = False
+                            raise
+            finally:
+                # Recorded here so turns whose client left still count towards the metrics.
+                await done
+                if not reading:
+                    logger.info(f"Turn for '{npc}/{session_id}' finished after its client left")
+                if not failed:
+                    self.counters["turns"] += 1
+                    self.latency["turn"].record((time.perf_counter() - start) * 1000)
+
+    async def __connection__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self.__read_request__(reader), IDLE_TIMEOUT)
+                except HttpError as e:
+                    await self.__respond__(writer, e.status, {"error": e.message}, keep_alive=False)
+                    break
+                if request == None:
+                    break
+                self.counters["requests"] += 1
+                if not await self.__dispatch__(request, reader, writer):
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def __read_request__(self, reader: asyncio.StreamReader) -> Request:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as e:
+            if e.partial.strip():
+                raise HttpError(400, "Incomplete request")
+            return None
+        except asyncio.LimitOverrunError:
+            raise HttpError(431, "Request headers are too large")
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ")
+        except ValueError:
+            raise HttpError(400, f"Malformed request line: {lines[0]!r}")
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            raise HttpError(400, "Chunked request bodies are not supported")
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise HttpError(400, "Invalid Content-Length")
+        if length > MAX_BODY_BYTES:
+            raise HttpError(413, f"Request body is larger than {MAX_BODY_BYTES} bytes")
+        body = await reader.readexactly(length) if length else b""
+        return Request(method, target, version, headers, body)
+
+    async def __dispatch__(self, request: Request, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        try:
+            match request.path:
+                case ["health"]:
+                    self.__allow__(request, "GET")
+                    await self.__respond__(writer, 200, {"status": "ok", "npcs": sorted(self.npcs),
+                                                         "inflight": self.inflight, "queued": self.queued},
+                                           keep_alive=request.keep_alive)
+                case ["metrics"]:
+                    self.__allow__(request, "GET")
+                    await self.__respond__(writer, 200, await self.__metrics__(), keep_alive=request.keep_alive)
+                case ["npcs", npc, "sessions", session_id, "turns"]:
+                    self.__allow__(request, "POST")
+                    return await self.__http_turn__(request, writer, npc, session_id)
+                case ["npcs", npc, "sessions", session_id, "ws"]:
+                    self.__allow__(request, "GET")
+                    self.__pipeline__(npc)
+                    await self.__websocket__(request, reader, writer, npc, session_id)
+                    return False
+                case _:
+                    raise HttpError(404, f"No route for /{'/'.join(request.path)}")
+        except HttpError as e:
+            await self.__respond__(writer, e.status, {"error": e.message}, keep_alive=request.keep_alive)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            raise
+        except Exception as e:
+            logger.exception(f"Request {request.method} /{'/'.join(request.path)} failed")
+            await self.__respond__(writer, 500, {"error": f"{type(e).__name__}: {e}"}, keep_alive=False)
+            return False
+        return request.keep_alive
+
+    def __allow__(self, request: Request, method: str):
+        if request.method != method:
+            raise HttpError(405, f"Use {method}")
+
+    async def __metrics__(self) -> dict[str, any]:
+        metrics = self.metrics()
+        pools = {name: pipeline for name, pipeline in self.npcs.items() if isinstance(pipeline, ServingPool)}
+        if pools:
+            loop = asyncio.get_running_loop()
+            metrics["workers"] = {name: await loop.run_in_executor(None, pool.stats) for name, pool in pools.items()}
+        return metrics
+
+    async def __http_turn__(self, request: Request, writer: asyncio.StreamWriter, npc: str, session_id: str) -> bool:
+        data = request.json()
+        text = data.get("input")
+        if not isinstance(text, str) or not text.strip():
+            raise HttpError(400, "'input' must be a non-empty string")
+        turn = self.__turn__(npc, session_id, text)
+        if not data.get("stream"):
+            output = "".join([chunk async for chunk in turn])
+            await self.__respond__(writer, 200, {"npc": npc, "session": session_id, "output": output},
+                                   keep_alive=request.keep_alive)
+            return request.keep_alive
+
+        # Nothing is sent before the turn is admitted, so shedding still gets a 503.
+        try:
+            first = await anext(turn, None)
+        except HttpError:
+            await turn.aclose()
+            raise
+        await self.__write_head__(writer, 200, {"Content-Type": "text/plain; charset=utf-8",
+                                                "Transfer-Encoding": "chunked"}, request.keep_alive)
+        # Past the head an error can't become a response any more; leaving the chunked
+        # body unterminated and closing tells the client the reply is incomplete.
+        try:
+            if first != None:
+                await self.__write_chunk__(writer, first)
+            async for chunk in turn:
+                await self.__write_chunk__(writer, chunk)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            await turn.aclose()
+            raise
+        except Exception:
+            await turn.aclose()
+            logger.exception(f"Streamed turn for '{npc}/{session_id}' failed")
+            return False
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        return request.keep_alive
+
+    async def __websocket__(self, request: Request, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                            npc: str, session_id: str):
+        key = request.headers.get("sec-websocket-key")
+        if request.headers.get("upgrade", "").lower() != "websocket" or key == None:
+            raise HttpError(400, "Expected a WebSocket upgrade")
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode("ascii")).digest()).decode("ascii")
+        await self.__write_head__(writer, 101, {"Upgrade": "websocket", "Connection": "Upgrade",
+                                                "Sec-WebSocket-Accept": accept}, keep_alive=True)
+        self.counters["websockets"] += 1
+        # Turns on one socket run one after another; a shed turn is reported and the
+        # socket stays open.
+        while True:
+            message = await self.__read_message__(reader, writer)
+            if message == None:
+                return
+            try:
+                data = json.loads(message)
+                text = data.get("input") if isinstance(data, dict) else None
+                if not isinstance(text, str) or not text.strip():
+                    raise HttpError(400, "'input' must be a non-empty string")
+                chunks = []
+                # Closed here rather than by the finalizer, so a send failing mid-turn
+                # releases the session and the concurrency slot straight away.
+                async with contextlib.aclosing(self.__turn__(npc, session_id, text)) as turn:
+                    async for chunk in turn:
+                        chunks.append(chunk)
+                        await self.__send_frame__(writer, OPCODE_TEXT, json.dumps({"type": "chunk", "text": chunk}))
+                reply = {"type": "done", "output": "".join(chunks)}
+            except ValueError as e:
+                reply = {"type": "error", "status": 400, "message": f"Invalid JSON message: {e}"}
+            except HttpError as e:
+                reply = {"type": "error", "status": e.status, "message": e.message}
+            except (asyncio.IncompleteReadError, ConnectionError):
+                raise
+            except Exception as e:
+                logger.exception(f"WebSocket turn for '{npc}/{session_id}' failed")
+                reply = {"type": "error", "status": 500, "message": f"{type(e).__name__}: {e}"}
+            await self.__send_frame__(writer, OPCODE_TEXT, json.dumps(reply))
+
+    async def __read_message__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> str:
+        # Reassembles fragmented messages and answers control frames; None once the
+        # client closes.
+        parts = []
+        size = 0
+        while True:
+            head = await reader.readexactly(2)
+            fin, opcode = head[0] & 0x80, head[0] & 0x0F
+            masked, length = head[1] & 0x80, head[1] & 0x7F
+            if length == 126:
+                length = struct.unpack("!H", await reader.readexactly(2))[0]
+            elif length == 127:
+                length = struct.unpack("!Q", await reader.readexactly(8))[0]
+            if size + length > MAX_BODY_BYTES:
+                await self.__send_frame__(writer, OPCODE_CLOSE, struct.pack("!H", 1009))
+                return None
+            mask = await reader.readexactly(4) if masked else None
+            payload = await reader.readexactly(length)
+            if mask != None:
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+            if opcode == OPCODE_CLOSE:
+                await self.__send_frame__(writer, OPCODE_CLOSE, payload[:2])
+                return None
+            if opcode == OPCODE_PING:
+                await self.__send_frame__(writer, OPCODE_PONG, payload)
+            elif opcode in (OPCODE_CONTINUATION, OPCODE_TEXT, OPCODE_BINARY):
+                parts.append(payload)
+                size += len(payload)
+                if fin:
+                    return b"".join(parts).decode("utf-8", errors="replace")
+            elif opcode != OPCODE_PONG:
+                await self.__send_frame__(writer, OPCODE_CLOSE, struct.pack("!H", 1002))
+                return None
+
+    async def __send_frame__(self, writer: asyncio.StreamWriter, opcode: int, payload: str | bytes):
+        data = payload.encode("utf-8") if isinstance(payload, str) else payload
+        if len(data) < 126:
+            head = struct.pack("!BB", 0x80 | opcode, len(data))
+        elif len(data) < 1 << 16:
+            head = struct.pack("!BBH", 0x80 | opcode, 126, len(data))
+        else:
+            head = struct.pack("!BBQ", 0x80 | opcode, 127, len(data))
+        writer.write(head + data)
+        await writer.drain()
+
+    async def __write_head__(self, writer: asyncio.StreamWriter, status: int, headers: dict[str, str], keep_alive: bool):
+        lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}"]
+        if status != 101:
+            headers = {**headers, "Connection": "keep-alive" if keep_alive else "close"}
+            if status == 503:
+                headers["Retry-After"] = "1"
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+
+    async def __write_chunk__(self, writer: asyncio.StreamWriter, chunk: str):
+        data = chunk.encode("utf-8")
+        if data:
+            writer.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            await writer.drain()
+
+    async def __respond__(self, writer: asyncio.StreamWriter, status: int, body: dict, keep_alive: bool = True):
+        data = json.dumps(body).encode("utf-8")
+        await self.__write_head__(writer, status, {"Content-Type": "application/json",
+                                                   "Content-Length": str(len(data))}, keep_alive)
+        writer.write(data)
+        await writer.drain()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--npc", default="default")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    parser.add_argument("--max-queue", type=int, default=64)
+    parser.add_argument("--stub", action="store_true", help="use the benchmark stub models and a synthetic NPC")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="stub LLM latency in seconds")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    logger.setLevel(logging.INFO)
+
+    if args.stub:
+        from benchmarks.serving import stub_pipeline
+        factory = functools.partial(stub_pipeline, "small", "fsm", "rules", args.llm_latency, 0)
+    else:
+        from main import config
+        factory = config
+    pipeline = ServingPool(factory, args.workers) if args.workers > 1 else factory()
+    server = DialogueServer({args.npc: pipeline}, args.host, args.port, args.max_concurrency, args.max_queue)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.executor.shutdown(wait=True)
+        if isinstance(pipeline, ServingPool):
+            pipeline.close()
+
+
+if __name__ == "__main__":
+    main()
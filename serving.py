@@ -0,0 +1,332 @@
+import bisect
+import hashlib
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import tempfile
+import threading
+from concurrent.futures import Future
+from typing import Callable, Iterator
+from condition import default_registry
+from session import DEFAULT_SESSION
+
+logger = logging.getLogger(__name__)
+
+# Requests go to a worker's own queue as (kind, request id, *args); every worker
+# answers on one shared queue with (request id, reply kind, payload).
+REQUEST_TURN = "turn"
+REQUEST_STREAM = "stream"
+REQUEST_REBALANCE = "rebalance"
+REQUEST_STATS = "stats"
+REQUEST_STOP = "stop"
+REPLY_CHUNK = "chunk"
+REPLY_DONE = "done"
+REPLY_ERROR = "error"
+
+
+class WorkerError(RuntimeError):
+    pass
+
+
+def ring_hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    # Every node sits at `replicas` points, so adding a node takes about 1/n of the
+    # keys from the others and removing one only moves the keys it owned.
+    def __init__(self, nodes: list[str] = None, replicas: int = 128):
+        self.replicas = replicas
+        self.nodes: set[str] = set()
+        self._points: list[int] = []
+        self._owners: list[str] = []
+        for node in nodes or []:
+            self.add(node)
+
+    def add(self, node: str):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for i in range(self.replicas):
+            point = ring_hash(f"{node}#{i}")
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove(self, node: str):
+        self.nodes.discard(node)
+        kept = [(point, owner) for point, owner in zip(self._points, self._owners) if owner != node]
+        self._points = [point for point, _ in kept]
+        self._owners = [owner for _, owner in kept]
+
+    def owner(self, key: str) -> str:
+        if not self._points:
+            raise LookupError("Hash ring has no nodes")
+        return self._owners[bisect.bisect(self._points, ring_hash(key)) % len(self._points)]
+
+
+def build_pipeline(factory: Callable[[], 'DialoguePipline'], spill_dir: str) -> 'DialoguePipline':
+    pipeline = factory()
+    if pipeline.sessions.spill_dir == None:
+        pipeline.sessions.spill_dir = spill_dir
+    return pipeline
+
+
+def refresh_pipeline(name: str, pipeline: 'DialoguePipline', factory: Callable[[], 'DialoguePipline'],
+                     spill_dir: str) -> 'DialoguePipline':
+    # A bundle swapped in at its path is picked up between turns: the pipeline is
+    # rebuilt from it and the old one's sessions are spilled for the new one to restore.
+    # Factories keep their loaded models across builds (see main.config), so only the
+    # bundle-dependent modules are built again.
+    bundle = default_registry.bundle
+    if bundle == None or not bundle.changed():
+        return pipeline
+    logger.info(f"Worker {name} reloading the NPC bundle from '{bundle.path}'")
+    try:
+        fresh = build_pipeline(factory, spill_dir)
+    except Exception:
+        logger.exception(f"Worker {name} failed to reload the NPC bundle, keeping the loaded one")
+        bundle.reject()
+        return pipeline
+    pipeline.sessions.release()
+    if pipeline.events != None:
+        pipeline.events.close()
+    return fresh
+
+
+def worker_main(name: str, factory: Callable[[], 'DialoguePipline'], spill_dir: str, replicas: int,
+                requests: multiprocessing.Queue, replies: multiprocessing.Queue, log_level: int):
+    # Turns are served one at a time, so a session is never touched by two turns
+    # at once and its turns run in the order they were routed.
+    logging.basicConfig(level=log_level)
+    pipeline = build_pipeline(factory, spill_dir)
+    turns = 0
+    while True:
+        kind, request_id, *args = requests.get()
+        try:
+            if kind in (REQUEST_TURN, REQUEST_STREAM):
+                pipeline = refresh_pipeline(name, pipeline, factory, spill_dir)
+            match kind:
+                case "turn":
+                    session_id, text = args
+                    replies.put((request_id, REPLY_DONE, pipeline.evaluate(text, session_id)))
+                    turns += 1
+                case "stream":
+                    session_id, text = args
+                    for chunk in pipeline.evaluate_stream(text, session_id):
+                        replies.put((request_id, REPLY_CHUNK, chunk))
+                    replies.put((request_id, REPLY_DONE, None))
+                    turns += 1
+                case "rebalance":
+                    ring = HashRing(args[0], replicas)
+                    released = pipeline.sessions.release(lambda session_id: ring.owner(session_id) == name)
+                    replies.put((request_id, REPLY_DONE, released))
+                case "stats":
+                    replies.put((request_id, REPLY_DONE, {
+                        "pid": os.getpid(), "turns": turns, "sessions": len(pipeline.sessions)}))
+                case "stop":
+                    released = pipeline.sessions.release()
+                    if pipeline.events != None:
+                        pipeline.events.close()
+                    replies.put((request_id, REPLY_DONE, released))
+                    return
+                case _:
+                    raise ValueError(f"Unknown request: {kind}")
+        except Exception as e:
+            logger.exception(f"Worker {name} failed on a {kind} request")
+            replies.put((request_id, REPLY_ERROR, f"{type(e).__name__}: {e}"))
+
+
+class WorkerProcess:
+    def __init__(self, name: str, process: multiprocessing.Process, requests: multiprocessing.Queue):
+        self.name = name
+        self.process = process
+        self.requests = requests
+        self.dead = False
+
+
+class ServingPool:
+    def __init__(self, factory: Callable[[], 'DialoguePipline'], workers: int = None, spill_dir: str = None,
+                 start_method: str = "spawn", replicas: int = 128, log_level: int = logging.WARNING):
+        # Each worker process builds its own pipeline with `factory`, which has to be
+        # picklable (a module-level function or a functools.partial of one). Sessions
+        # moving between workers go through `spill_dir`, which all of them share.
+        self.factory = factory
+        self.spill_dir = spill_dir if spill_dir != None else tempfile.mkdtemp(prefix="dialogue-sessions-")
+        self.replicas = replicas
+        self.log_level = log_level
+        self.context = multiprocessing.get_context(start_method)
+        self.ring = HashRing(replicas=replicas)
+        self.workers: dict[str, WorkerProcess] = {}
+        self.replies = self.context.Queue()
+        self._pending: dict[int, tuple[str, Future | queue.Queue]] = {}
+        self._ids = itertools.count()
+        self._names = itertools.count()
+        self._lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._collector = threading.Thread(target=self.__collect__, name="serving-replies", daemon=True)
+        self._collector.start()
+        for _ in range(workers if workers != None else os.cpu_count() or 1):
+            self.add_worker()
+
+    def submit(self, session_id: str, input: str) -> Future:
+        with self._lock:
+            return self.__send__(self.__route__(session_id), REQUEST_TURN, session_id, input)
+
+    def evaluate(self, input: str, session_id: str = DEFAULT_SESSION) -> str:
+        return self.submit(session_id, input).result()
+
+    def evaluate_stream(self, input: str, session_id: str = DEFAULT_SESSION) -> Iterator[str]:
+        with self._lock:
+            chunks = self.__send__(self.__route__(session_id), REQUEST_STREAM, session_id, input, stream=True)
+        while True:
+            kind, payload = chunks.get()
+            if kind == REPLY_CHUNK:
+                yield payload
+            elif kind == REPLY_ERROR:
+                raise WorkerError(payload)
+            else:
+                return
+
+    def add_worker(self) -> str:
+        # The workers that lose sessions to the new one spill them before any turn is
+        # routed by the new ring; the new owner restores them on their next turn.
+        with self._lock:
+            name = f"worker-{next(self._names)}"
+            requests = self.context.Queue()
+            process = self.context.Process(
+                target=worker_main, name=name, daemon=True,
+                args=(name, self.factory, self.spill_dir, self.replicas, requests, self.replies, self.log_level))
+            process.start()
+            self.ring.add(name)
+            nodes = sorted(self.ring.nodes)
+            moves = [self.__send__(other, REQUEST_REBALANCE, nodes) for other in self.workers]
+            self.workers[name] = WorkerProcess(name, process, requests)
+            ready = self.__send__(name, REQUEST_STATS)
+            moved = sum(move.result() for move in moves)
+            try:
+                ready.result()
+            except WorkerError:
+                self.ring.remove(name)
+                del self.workers[name]
+                raise
+        logger.info(f"Started {name} (pid {process.pid}), moved {moved} sessions to it")
+        return name
+
+    def remove_worker(self, name: str = None) -> str:
+        # A stopping worker spills all of its sessions; with it off the ring they are
+        # restored by whichever worker owns them now.
+        with self._lock:
+            if name == None:
+                name = max(self.workers, key=lambda n: int(n.rsplit("-", 1)[1]))
+            worker = self.workers[name]
+            self.ring.remove(name)
+            released = 0
+            if not worker.dead:
+                released = self.__send__(name, REQUEST_STOP).result()
+            worker.process.join()
+            del self.workers[name]
+        logger.info(f"Stopped {name}, spilled {released} sessions")
+        return name
+
+    def stats(self) -> dict[str, dict]:
+        with self._pending_lock:
+            pending = [owner for owner, _ in self._pending.values()]
+        with self._lock:
+            workers = list(self.workers.values())
+            requests = {worker.name: self.__send__(worker.name, REQUEST_STATS) for worker in workers if not worker.dead}
+        stats = {}
+        for worker in workers:
+            data = requests[worker.name].result() if worker.name in requests else {"pid": worker.process.pid}
+            data["pending"] = pending.count(worker.name)
+            data["alive"] = not worker.dead
+            stats[worker.name] = data
+        return stats
+
+    def close(self):
+        for name in list(self.workers):
+            self.remove_worker(name)
+        self.replies.put((None, None, None))
+        self._collector.join()
+
+    def __enter__(self) -> 'ServingPool':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def __route__(self, session_id: str) -> str:
+        # A worker that died takes no more turns; its sessions go to the next owner on
+        # the ring, which restores whatever it had spilled. The last worker is kept so
+        # requests fail instead of finding an empty ring.
+        name = self.ring.owner(session_id)
+        while self.workers[name].dead and len(self.ring.nodes) > 1:
+            self.__retire__(name)
+            name = self.ring.owner(session_id)
+        return name
+
+    def __retire__(self, name: str):
+        worker = self.workers.pop(name)
+        self.ring.remove(name)
+        worker.process.join()
+        logger.warning(f"Removed {name} from the ring after it exited with code {worker.process.exitcode}")
+
+    def __send__(self, name: str, kind: str, *args, stream: bool = False) -> Future | queue.Queue:
+        # The dead check and the insert share a lock with __reap__, so a request is
+        # either failed here or registered before the reaper collects that worker's.
+        target = queue.Queue() if stream else Future()
+        worker = self.workers[name]
+        request_id = next(self._ids)
+        with self._pending_lock:
+            dead = worker.dead
+            if not dead:
+                self._pending[request_id] = (name, target)
+        if dead:
+            self.__fail__(target, f"Worker {name} has exited")
+            return target
+        worker.requests.put((kind, request_id, *args))
+        return target
+
+    def __fail__(self, target: Future | queue.Queue, message: str):
+        if isinstance(target, Future):
+            target.set_exception(WorkerError(message))
+        else:
+            target.put((REPLY_ERROR, message))
+
+    def __collect__(self):
+        while True:
+            try:
+                request_id, kind, payload = self.replies.get(timeout=1)
+            except queue.Empty:
+                self.__reap__()
+                continue
+            if request_id == None:
+                return
+            with self._pending_lock:
+                entry = self._pending.get(request_id) if kind == REPLY_CHUNK else self._pending.pop(request_id, None)
+            if entry == None:
+                continue
+            target = entry[1]
+            if isinstance(target, queue.Queue):
+                target.put((kind, payload))
+            elif kind == REPLY_ERROR:
+                target.set_exception(WorkerError(payload))
+            else:
+                target.set_result(payload)
+
+    def __reap__(self):
+        # Requests queued on a worker that died would otherwise wait forever.
+        for worker in list(self.workers.values()):
+            if worker.dead or worker.process.is_alive():
+                continue
+            with self._pending_lock:
+                worker.dead = True
+                failed = [request_id for request_id, (owner, _) in self._pending.items() if owner == worker.name]
+                targets = [self._pending.pop(request_id)[1] for request_id in failed]
+            for target in targets:
+                self.__fail__(target, f"Worker {worker.name} exited with code {worker.process.exitcode}")
+            logger.error(f"Worker {worker.name} exited with code {worker.process.exitcode}, "
+                         f"failed {len(targets)} pending requests")
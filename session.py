@@ -0,0 +1,140 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable
+from cache import cache_key
+from facts import FactSystem
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SESSION = "default"
+
+
+class Session:
+    def __init__(self, session_id: str, history: list[str] = None, data: dict[str, any] = None, facts: FactSystem = None):
+        self.id: str = session_id
+        self.history: list[str] = history if history != None else []
+        self.data: dict[str, any] = data if data != None else {}
+        self.facts: FactSystem = facts
+        self.lock = threading.Lock()
+        self.last_used: float = time.monotonic()
+        # Turns holding the session; a pinned session is never spilled or dropped.
+        self.pins = 0
+
+    def to_dict(self) -> dict[str, any]:
+        return {
+            "id": self.id,
+            "history": self.history,
+            "data": self.data,
+            "facts": self.facts.to_dict() if self.facts != None else None,
+        }
+
+    @staticmethod
+    def from_dict(data: dict[str, any], facts: FactSystem = None) -> 'Session':
+        if facts != None:
+            for key, value in (data.get("facts") or {}).items():
+                facts.set_fact(key, value)
+        return Session(data["id"], data.get("history"), data.get("data"), facts)
+
+
+class SessionStore:
+    def __init__(self, capacity: int = 1024, spill_dir: str = None, facts_factory: Callable[[], FactSystem] = None):
+        self.capacity = capacity
+        self.spill_dir = spill_dir
+        self.facts_factory = facts_factory
+        self._sessions: OrderedDict[str, Session] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str, pin: bool = False) -> Session:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session != None:
+                self._sessions.move_to_end(session_id)
+            else:
+                session = self.__restore__(session_id)
+                if session == None:
+                    logger.info(f"New session: '{session_id}'")
+                    session = Session(session_id, facts=self.__new_facts__())
+                self._sessions[session_id] = session
+            session.last_used = time.monotonic()
+            if pin:
+                session.pins += 1
+            self.__evict__(session_id)
+            return session
+
+    @contextmanager
+    def use(self, session_id: str):
+        # Pins the session for the duration of a turn, so eviction between looking it
+        # up and locking it can't detach it from the store.
+        session = self.get(session_id, pin=True)
+        try:
+            yield session
+        finally:
+            with self._lock:
+                session.pins -= 1
+                session.last_used = time.monotonic()
+
+    def spill_idle(self, max_idle: float):
+        now = time.monotonic()
+        with self._lock:
+            for session_id, session in list(self._sessions.items()):
+                if now - session.last_used > max_idle and session.pins == 0:
+                    self.__spill__(self._sessions.pop(session_id))
+
+    def release(self, keep: Callable[[str], bool] = None) -> int:
+        # Spills every session `keep` rejects (all of them without one), e.g. when
+        # sessions move to another worker process. Sessions in a turn are kept.
+        with self._lock:
+            released = [session_id for session_id, session in self._sessions.items()
+                        if session.pins == 0 and (keep == None or not keep(session_id))]
+            for session_id in released:
+                self.__spill__(self._sessions.pop(session_id))
+        return len(released)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    def __new_facts__(self) -> FactSystem:
+        return self.facts_factory() if self.facts_factory != None else None
+
+    def __evict__(self, current: str = None):
+        # Sessions in the middle of a turn are skipped so their state is not spilled half-updated,
+        # and so is the one just handed out.
+        for session_id in list(self._sessions.keys()):
+            if len(self._sessions) <= self.capacity:
+                break
+            if self._sessions[session_id].pins == 0 and session_id != current:
+                self.__spill__(self._sessions.pop(session_id))
+
+    def __path__(self, session_id: str) -> str:
+        return os.path.join(self.spill_dir, f"{cache_key(session_id)}.json")
+
+    def __spill__(self, session: Session):
+        if self.spill_dir == None:
+            logger.info(f"Dropped session: '{session.id}'")
+            return
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = self.__path__(session.id)
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump(session.to_dict(), file)
+        os.replace(path + ".tmp", path)
+        logger.info(f"Spilled session '{session.id}' to '{path}'")
+
+    def __restore__(self, session_id: str) -> Session:
+        if self.spill_dir == None:
+            return None
+        path = self.__path__(session_id)
+        if not os.path.isfile(path):
+            return None
+        with open(path, "r", encoding="utf-8") as file:
+            session = Session.from_dict(json.load(file), self.__new_facts__())
+        os.remove(path)
+        logger.info(f"Restored session '{session_id}' from '{path}'")
+        return session
@@ -0,0 +1,67 @@
+import logging
+import re
+import weakref
+from facts import FactSystem
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER = re.compile(r'\$\{(.*?)\}')
+
+
+class Template:
+    def __init__(self, text: str):
+        self.text = text
+        parts = PLACEHOLDER.split(text)
+        self.segments: list[str] = parts[0::2]
+        self.slots: list[str] = parts[1::2]
+        # Keyed weakly by fact system so per-session fact systems can be collected.
+        self._rendered: weakref.WeakKeyDictionary[FactSystem, str] = weakref.WeakKeyDictionary()
+        self._subscribed: weakref.WeakSet[FactSystem] = weakref.WeakSet()
+
+    def render(self, facts: FactSystem) -> str:
+        if not self.slots:
+            return self.text
+        rendered = self._rendered.get(facts)
+        if rendered == None:
+            if facts not in self._subscribed:
+                self.__subscribe__(facts)
+            values = [facts.get_fact(slot).get() for slot in self.slots]
+            pieces = [self.segments[0]]
+            for value, segment in zip(values, self.segments[1:]):
+                pieces.append(str(value) if value else "")
+                pieces.append(segment)
+            rendered = "".join(pieces)
+            self._rendered[facts] = rendered
+        return rendered
+
+    def __subscribe__(self, facts: FactSystem):
+        self._subscribed.add(facts)
+        ref = weakref.ref(facts)
+        for slot in set(self.slots):
+            facts.get_fact(slot).add_callback_no_args(lambda: self._rendered.pop(ref(), None))
+
+
+class TemplateRegistry:
+    def __init__(self, max_templates: int = 65536):
+        self.max_templates = max_templates
+        self._templates: dict[str, Template] = {}
+
+    def compile(self, text: str) -> Template:
+        template = self._templates.get(text)
+        if template == None:
+            if len(self._templates) >= self.max_templates:
+                logger.warning(f"Template registry is full, clearing {len(self._templates)} templates")
+                self._templates.clear()
+            template = Template(text)
+            self._templates[text] = template
+        return template
+
+    def __len__(self) -> int:
+        return len(self._templates)
+
+
+default_templates = TemplateRegistry()
+
+
+def compile_template(text: str) -> Template:
+    return default_templates.compile(text)
@@ -0,0 +1,22 @@
+import json
+from cache import JsonCache
+
+
+def test_torn_last_record_is_dropped(tmp_path):
+    path = tmp_path / "cache.jsonl"
+    path.write_text(json.dumps({"key": "a", "value": 1}) + "\n" + '{"key": "b", "val', encoding="utf-8")
+    cache = JsonCache(str(path))
+    assert cache.get("a") == 1
+    assert cache.get("b") == None
+    cache.put("c", 3)
+    reloaded = JsonCache(str(path))
+    assert reloaded.get("a") == 1
+    assert reloaded.get("c") == 3
+
+
+def test_unreadable_record_is_skipped(tmp_path):
+    path = tmp_path / "cache.jsonl"
+    path.write_text('{"key": "a", "val\n' + json.dumps({"key": "b", "value": 2}) + "\n", encoding="utf-8")
+    cache = JsonCache(str(path))
+    assert cache.get("b") == 2
+    assert len(cache) == 1
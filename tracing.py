@@ -0,0 +1,155 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the latency histogram buckets, in milliseconds.
+BUCKETS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+class Span:
+    __slots__ = ("tracer", "name", "category", "args", "start")
+
+    def __init__(self, tracer: 'Tracer', name: str, category: str, args: dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = 0.0
+
+    def set(self, **args):
+        self.args.update(args)
+
+    def __enter__(self) -> 'Span':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type != None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.record(self, time.perf_counter() - self.start)
+        return False
+
+
+class NullSpan:
+    __slots__ = ()
+
+    def set(self, **args):
+        pass
+
+    def __enter__(self) -> 'NullSpan':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, ms: float):
+        self.counts[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def quantile(self, q: float) -> float:
+        # Upper bound of the bucket holding the quantile.
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS_MS + [self.max], self.counts):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self) -> dict[str, Any]:
+        labels = [f"<={bound}ms" for bound in BUCKETS_MS] + [f">{BUCKETS_MS[-1]}ms"]
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count if self.count else 0,
+            "p50_ms": self.quantile(0.5),
+            "p99_ms": self.quantile(0.99),
+            "max_ms": self.max,
+            "buckets": {label: count for label, count in zip(labels, self.counts) if count},
+        }
+
+
+class Tracer:
+    def __init__(self, enabled: bool = False, max_events: int = 100000):
+        # Disabled tracers hand out one shared no-op span; hot paths also check
+        # `enabled` before building span arguments at all.
+        self.enabled = enabled
+        self.events: deque[dict[str, Any]] = deque(maxlen=max_events)
+        self.histograms: dict[str, Histogram] = {}
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def span(self, name: str, category: str = "stage", **args) -> Span | NullSpan:
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, category, args)
+
+    def record(self, span: Span, duration: float):
+        event = {
+            "name": span.name,
+            "cat": span.category,
+            "ph": "X",
+            "ts": (span.start - self._origin) * 1e6,
+            "dur": duration * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": span.args,
+        }
+        with self._lock:
+            self.events.append(event)
+            histogram = self.histograms.get(f"{span.category}/{span.name}")
+            if histogram == None:
+                histogram = self.histograms[f"{span.category}/{span.name}"] = Histogram()
+            histogram.record(duration * 1000)
+
+    def clear(self):
+        with self._lock:
+            self.events.clear()
+            self.histograms.clear()
+
+    def summary(self, category: str = None) -> dict[str, dict[str, Any]]:
+        with self._lock:
+            return {name: histogram.to_dict() for name, histogram in sorted(self.histograms.items())
+                    if category == None or name.startswith(f"{category}/")}
+
+    def to_chrome(self) -> dict[str, Any]:
+        with self._lock:
+            return {"traceEvents": list(self.events), "displayTimeUnit": "ms"}
+
+    def export_chrome(self, path: str):
+        # Loadable in chrome://tracing and Perfetto.
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_chrome(), f, default=str)
+        logger.info(f"Wrote {len(self.events)} trace events to {path}")
+
+    def export_summary(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+tracer = Tracer()
@@ -1,5 +1,11 @@
-from typing import Callable
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Iterable, Iterator
+import torch
 from torch import Tensor
+from cache import JsonCache, EmbeddingCache, cache_key
+from batching import MicroBatcher
+from tracing import tracer
 
 
 class SummarizationWrapper():
@@ -7,7 +13,8 @@ class SummarizationWrapper():
         self.func = func
 
     def summarize(self, text: str, min_len: int, max_len: int) -> str:
-        return self.func(text, min_len, max_len)
+        with tracer.span("summarize", "wrapper", chars=len(text)):
+            return self.func(text, min_len, max_len)
 
 
 class EmbedderWrapper():
@@ -15,7 +22,36 @@ class EmbedderWrapper():
         self.func = func
 
     def encode(self, arg: str) -> Tensor:
-        return self.func(arg)
+        with tracer.span("embed", "wrapper", chars=len(arg)):
+            return self.func(arg)
+
+    def encode_static(self, arg: str) -> Tensor:
+        return self.encode(arg)
+
+
+class CachedEmbedderWrapper(EmbedderWrapper):
+    def __init__(self, func: Callable[[str], Tensor], model_id: str, cache: EmbeddingCache, device: str = "cpu"):
+        super().__init__(func)
+        self.model_id = model_id
+        self.cache = cache
+        self.device = device
+
+    def encode_static(self, arg: str) -> Tensor:
+        with tracer.span("embed_static", "wrapper", chars=len(arg)) as span:
+            key = cache_key(self.model_id, arg)
+            vector = self.cache.get(key)
+            span.set(cache_hit=vector is not None)
+            if vector is not None:
+                return torch.from_numpy(vector.copy()).to(self.device)
+            embedding = self.encode(arg)
+            self.cache.put(key, embedding.detach().float().cpu().numpy())
+            return embedding
+
+
+class BatchingEmbedderWrapper(EmbedderWrapper):
+    def __init__(self, batch_func: Callable[[list[str]], list[Tensor]], max_batch_size: int = 32, max_wait: float = 0.005):
+        self.batcher = MicroBatcher(batch_func, max_batch_size, max_wait, "embedder")
+        super().__init__(self.batcher)
 
 
 class SentimentWrapper():
@@ -23,7 +59,14 @@ class SentimentWrapper():
         self.func = func
 
     def encode(self, arg: str) -> dict:
-        return self.func(arg)
+        with tracer.span("sentiment", "wrapper", chars=len(arg)):
+            return self.func(arg)
+
+
+class BatchingSentimentWrapper(SentimentWrapper):
+    def __init__(self, batch_func: Callable[[list[str]], list[dict]], max_batch_size: int = 32, max_wait: float = 0.005):
+        self.batcher = MicroBatcher(batch_func, max_batch_size, max_wait, "sentiment")
+        super().__init__(self.batcher)
 
 
 class ExtractionWrapper():
@@ -31,18 +74,105 @@ class ExtractionWrapper():
         self.func = func
 
     def extract_entities(self, text: str) -> list[str]:
-        return self.func(text)
+        with tracer.span("ner", "wrapper", chars=len(text)):
+            return self.func(text)
+
+
+class BatchingExtractionWrapper(ExtractionWrapper):
+    def __init__(self, batch_func: Callable[[list[str]], list[list[str]]], max_batch_size: int = 32, max_wait: float = 0.005):
+        self.batcher = MicroBatcher(batch_func, max_batch_size, max_wait, "extraction")
+        super().__init__(self.batcher)
 
 
 class ParaphraserWrapper():
     def __init__(self, func: Callable[[int, str], list[str]]):
         self.func = func
     def paraphrase(self, num: int, text: str) -> list[str]:
-        return self.func(num, text)
+        with tracer.span("paraphrase", "wrapper", chars=len(text), num=num):
+            return self.func(num, text)
+
+
+class CachedParaphraserWrapper(ParaphraserWrapper):
+    def __init__(self, func: Callable[[int, str], list[str]], model_id: str, cache: JsonCache):
+        super().__init__(func)
+        self.model_id = model_id
+        self.cache = cache
+
+    def paraphrase(self, num: int, text: str) -> list[str]:
+        with tracer.span("paraphrase", "wrapper", chars=len(text), num=num) as span:
+            key = cache_key(self.model_id, num, text)
+            paraphrases = self.cache.get(key)
+            span.set(cache_hit=paraphrases != None)
+            if paraphrases == None:
+                paraphrases = self.func(num, text)
+                self.cache.put(key, paraphrases)
+            return paraphrases
+
+def traced_chunks(chunks: Iterable[str], span) -> Iterator[str]:
+    start = time.perf_counter()
+    count = 0
+    for chunk in chunks:
+        if chunk:
+            if count == 0:
+                span.set(first_chunk_ms=(time.perf_counter() - start) * 1000)
+            count += 1
+            yield chunk
+    span.set(chunks=count)
+
 
 class LLMWrapper():
-    def __init__(self, func: Callable[[str], str]):
+    def __init__(self, func: Callable[[str], str], stream_func: Callable[[str], Iterable[str]] = None):
         self.func = func
+        self.stream_func = stream_func
 
     def generate(self, text: str) -> str:
-        return self.func(text)
+        with tracer.span("llm", "wrapper", chars=len(text)):
+            return self.func(text)
+
+    def generate_stream(self, text: str) -> Iterator[str]:
+        if self.stream_func == None:
+            yield self.generate(text)
+            return
+        with tracer.span("llm_stream", "wrapper", chars=len(text)) as span:
+            yield from traced_chunks(self.stream_func(text), span)
+
+    def prefix_id(self, prefix: str) -> str:
+        return cache_key(prefix)
+
+    def generate_prefixed(self, prefix: str, suffix: str) -> str:
+        return self.generate(prefix + suffix)
+
+    def generate_prefixed_stream(self, prefix: str, suffix: str) -> Iterator[str]:
+        return self.generate_stream(prefix + suffix)
+
+
+class ContextLLMWrapper(LLMWrapper):
+    def __init__(self, func: Callable[[str], str], prime_func: Callable[[str], Any], context_func: Callable[[Any, str], str], context_stream_func: Callable[[Any, str], Iterable[str]] = None, stream_func: Callable[[str], Iterable[str]] = None, max_contexts: int = 64):
+        super().__init__(func, stream_func)
+        self.prime_func = prime_func
+        self.context_func = context_func
+        self.context_stream_func = context_stream_func
+        self.max_contexts = max_contexts
+        self.contexts: OrderedDict[str, Any] = OrderedDict()
+
+    def context(self, prefix: str) -> Any:
+        prefix_id = self.prefix_id(prefix)
+        if prefix_id in self.contexts:
+            self.contexts.move_to_end(prefix_id)
+            return self.contexts[prefix_id]
+        context = self.prime_func(prefix)
+        self.contexts[prefix_id] = context
+        if len(self.contexts) > self.max_contexts:
+            self.contexts.popitem(last=False)
+        return context
+
+    def generate_prefixed(self, prefix: str, suffix: str) -> str:
+        with tracer.span("llm", "wrapper", chars=len(suffix), context_hit=tracer.enabled and self.prefix_id(prefix) in self.contexts):
+            return self.context_func(self.context(prefix), suffix)
+
+    def generate_prefixed_stream(self, prefix: str, suffix: str) -> Iterator[str]:
+        if self.context_stream_func == None:
+            yield self.generate_prefixed(prefix, suffix)
+            return
+        with tracer.span("llm_stream", "wrapper", chars=len(suffix), context_hit=tracer.enabled and self.prefix_id(prefix) in self.contexts) as span:
+            yield from traced_chunks(self.context_stream_func(self.context(prefix), suffix), span)